@@ -0,0 +1,60 @@
+# Actions are small objects kept one per entity and rescheduled as the
+# entity steps, instead of a new closure per step.  Calling one takes it
+# off its owner's pending actions and runs the owner's method for its kind.
+
+class Action(object):
+   __slots__ = ('owner', 'world', 'i_store')
+   kind = None
+
+   def __init__(self, owner, world, i_store=None):
+      self.owner = owner
+      self.world = world
+      self.i_store = i_store
+
+   def __call__(self, current_ticks):
+      self.owner.remove_pending_action(self)
+      return self.run(current_ticks)
+
+
+class MinerAction(Action):
+   __slots__ = ()
+   kind = 'miner'
+
+   def run(self, current_ticks):
+      return self.owner.run_miner_action(self.world, self.i_store,
+         current_ticks)
+
+
+class VeinAction(Action):
+   __slots__ = ()
+   kind = 'vein'
+
+   def run(self, current_ticks):
+      return self.owner.run_vein_action(self.world, self.i_store,
+         current_ticks)
+
+
+class OreTransformAction(Action):
+   __slots__ = ()
+   kind = 'ore_transform'
+
+   def run(self, current_ticks):
+      return self.owner.run_ore_transform_action(self.world, self.i_store,
+         current_ticks)
+
+
+class OreBlobAction(Action):
+   __slots__ = ()
+   kind = 'ore_blob'
+
+   def run(self, current_ticks):
+      return self.owner.run_ore_blob_action(self.world, self.i_store,
+         current_ticks)
+
+
+class EntityDeathAction(Action):
+   __slots__ = ()
+   kind = 'entity_death'
+
+   def run(self, current_ticks):
+      return self.owner.run_entity_death_action(self.world, current_ticks)
@@ -0,0 +1,216 @@
+import engine
+import entities
+import image_store
+import json
+import multiprocessing
+import platform
+import point
+import random
+import resource
+import save_load
+import subprocess
+import sys
+import time
+
+OUTPUT_FILE = 'benchmark.json'
+RUN_SECONDS = 30
+SEED = 102
+
+MINER_LIMIT = 2
+MINER_RATE = 800
+MINER_ANIMATION_RATE = 100
+VEIN_RATE = 12000
+ORE_RATE = 25000
+SMITH_RATE = 3000
+SMITH_LIMIT = 12
+SMITH_RATIO = 50
+
+# name, columns, rows, entities; a world of None loads engine.WORLD_FILE.
+CASES = [
+   ('gaia', None, None, None),
+   ('40x30-10', 40, 30, 10),
+   ('100x100-1k', 100, 100, 1000),
+   ('300x300-10k', 300, 300, 10000),
+   ('1000x1000-100k', 1000, 1000, 100000),
+]
+
+PHASES = {
+   'find_nearest': ['find_nearest'],
+   'next_position': ['next_position', 'blob_next_position',
+      'path_next_position', 'blob_path_next_position'],
+   'scheduling': ['schedule_action', 'unschedule_action'],
+}
+# Timed on each of the world's distance fields.  A field is rebuilt lazily
+# by the next path query, so rebuilds count toward next_position as well.
+FIELD_PHASES = {
+   'distance_fields': ['rebuild', 'entity_added', 'entity_removed'],
+}
+
+
+def create_synthetic_world(i_store, num_cols, num_rows, count, rng):
+   world = engine.create_world(i_store, num_rows, num_cols)
+   num_smiths = count // SMITH_RATIO + 1
+   cells = rng.sample(range(num_cols * num_rows), count + num_smiths)
+
+   for (i, cell) in enumerate(cells):
+      pt = point.Point(cell % num_cols, cell // num_cols)
+      name = str(i)
+      if i < num_smiths:
+         entity = entities.Blacksmith('blacksmith' + name, pt,
+            image_store.get_images(i_store, 'blacksmith'), SMITH_RATE,
+            SMITH_LIMIT)
+      elif i % 5 < 2:
+         entity = entities.MinerNotFull('miner' + name, pt,
+            image_store.get_images(i_store, 'miner'), MINER_ANIMATION_RATE,
+            MINER_RATE, MINER_LIMIT)
+      elif i % 5 == 2:
+         entity = entities.Vein('vein' + name, pt,
+            image_store.get_images(i_store, 'vein'), VEIN_RATE)
+      else:
+         entity = entities.Ore('ore' + name, pt,
+            image_store.get_images(i_store, 'ore'), ORE_RATE)
+      world.add_entity(entity)
+      save_load.schedule_entity(world, entity, i_store)
+
+   return world
+
+
+def create_case_world(case, i_store, rng):
+   (name, num_cols, num_rows, count) = case
+   if num_cols is None:
+      world = engine.create_world(i_store)
+      engine.load_world(world, i_store, engine.WORLD_FILE)
+      return world
+   return create_synthetic_world(i_store, num_cols, num_rows, count, rng)
+
+
+def timed(method, totals, phase, active):
+   # A method called from another of its own phase, as the path methods
+   # fall back on the greedy steps, is only counted once.
+   def wrapper(*args):
+      if phase in active:
+         return method(*args)
+      active.add(phase)
+      start = time.perf_counter()
+      try:
+         return method(*args)
+      finally:
+         totals[phase] += time.perf_counter() - start
+         active.discard(phase)
+   return wrapper
+
+
+def instrument(world, totals, counts):
+   active = set()
+   for (phase, names) in PHASES.items():
+      totals[phase] = 0.0
+      for name in names:
+         setattr(world, name, timed(getattr(world, name), totals, phase,
+            active))
+   for (phase, names) in FIELD_PHASES.items():
+      totals[phase] = 0.0
+      for field in world.distance_fields.values():
+         for name in names:
+            setattr(field, name, timed(getattr(field, name), totals, phase,
+               active))
+
+   queue = world.action_queue
+   pop = queue.pop
+   def counted_pop():
+      counts['actions'] += 1
+      return pop()
+   queue.pop = counted_pop
+
+
+def run_case(case, seconds):
+   random.seed(SEED)
+   rng = random.Random(SEED)
+   i_store = image_store.load_placeholder_images(engine.IMAGE_LIST_FILE_NAME)
+
+   start = time.perf_counter()
+   world = create_case_world(case, i_store, rng)
+   setup_time = time.perf_counter() - start
+
+   totals = {}
+   counts = {'actions': 0, 'ticks': 0}
+   instrument(world, totals, counts)
+
+   sim = engine.Engine(world)
+   max_depth = len(world.action_queue)
+   start = time.perf_counter()
+   while sim.ticks < seconds * 1000:
+      sim.step()
+      counts['ticks'] += 1
+      max_depth = max(max_depth, len(world.action_queue))
+   wall_time = time.perf_counter() - start
+
+   return {
+      'case': case[0],
+      'columns': world.num_cols,
+      'rows': world.num_rows,
+      'entities': len(world.get_entities()),
+      'simulated_seconds': seconds,
+      'setup_seconds': setup_time,
+      'wall_seconds': wall_time,
+      'ticks': counts['ticks'],
+      'ticks_per_second': counts['ticks'] / wall_time,
+      'actions': counts['actions'],
+      'actions_per_second': counts['actions'] / wall_time,
+      'final_queue_depth': len(world.action_queue),
+      'max_queue_depth': max_depth,
+      'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+      'phase_seconds': totals,
+   }
+
+
+def run_isolated(case, seconds):
+   # A fresh process per case keeps the peak memory figures independent.
+   pool = multiprocessing.Pool(1)
+   try:
+      return pool.apply(run_case, (case, seconds))
+   finally:
+      pool.close()
+      pool.join()
+
+
+def get_revision():
+   try:
+      return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+         stderr=subprocess.DEVNULL).decode().strip()
+   except (OSError, subprocess.CalledProcessError):
+      return None
+
+
+def print_result(result):
+   phases = ' '.join('%s=%.3f' % item
+      for item in sorted(result['phase_seconds'].items()))
+   print('%-16s %8d ent %9.1f ticks/s %11.1f actions/s %8d queue '
+      '%9d KB  %s' % (result['case'], result['entities'],
+      result['ticks_per_second'], result['actions_per_second'],
+      result['max_queue_depth'], result['peak_rss_kb'], phases))
+
+
+def main(argv):
+   seconds = int(argv[1]) if len(argv) > 1 else RUN_SECONDS
+   filename = argv[2] if len(argv) > 2 else OUTPUT_FILE
+   names = argv[3:]
+   cases = [case for case in CASES if not names or case[0] in names]
+
+   results = []
+   for case in cases:
+      result = run_isolated(case, seconds)
+      print_result(result)
+      results.append(result)
+
+   with open(filename, 'w') as file:
+      json.dump({
+         'revision': get_revision(),
+         'python': platform.python_version(),
+         'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+         'seed': SEED,
+         'results': results,
+      }, file, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+   main(sys.argv)
@@ -3,12 +3,14 @@ import entities
 import image_store
 import pygame
 import random
+import recording
 import save_load
 import worldmodel
 import worldview
 
 IMAGE_LIST_FILE_NAME = 'imagelist'
 WORLD_FILE = 'gaia.sav'
+TRACE_FILE = None
 
 WORLD_WIDTH_SCALE = 2
 WORLD_HEIGHT_SCALE = 2
@@ -24,7 +26,8 @@ def create_default_background(img):
 
 
 def main():
-   random.seed()
+   seed = recording.new_seed()
+   random.seed(seed)
    pygame.init()
    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
    i_store = image_store.load_images(IMAGE_LIST_FILE_NAME,
@@ -42,7 +45,12 @@ def main():
 
    view.update_view()
 
-   builder_controller.activity_loop(view, world, i_store)
+   recorder = None
+   if TRACE_FILE:
+      recorder = recording.TraceRecorder(TRACE_FILE, recording.TraceHeader(
+         seed, '', num_rows, num_cols, False))
+
+   builder_controller.activity_loop(view, world, i_store, recorder)
 
 
 if __name__ == '__main__':
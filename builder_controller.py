@@ -6,6 +6,7 @@ import point
 import pygame
 import random
 import save_load
+import save_worker
 import worldview
 import worldmodel
 
@@ -28,15 +29,25 @@ SMITH_LIMIT_MAX = 15
 SMITH_RATE_MIN = 2000
 SMITH_RATE_MAX = 4000
 
+saver = None
+
 
 def save_world(world, filename):
-   with open(filename, 'w') as file:
-      save_load.save_world(world, file)
+   global saver
+   if saver is None:
+      saver = save_worker.SaveWorker()
+   saver.submit(save_load.take_snapshot(world), filename)
+
+
+def finish_saves():
+   if saver is not None:
+      saver.wait()
 
 
 def load_world(world, i_store, filename):
-   with open(filename, 'r') as file:
-      save_load.load_world(world, i_store, file)
+   # A save still being written may be newer than the file on disk.
+   finish_saves()
+   save_load.load_world_file(world, i_store, filename)
 
 
 def mouse_to_tile(pos, tile_width, tile_height):
@@ -48,26 +59,33 @@ def handle_mouse_motion(view, event):
    view.mouse_move(mouse_pt)
 
 
-def handle_mouse_button(view, world, event, entity_select, i_store):
+def handle_mouse_button(view, world, event, entity_select, i_store,
+   recorder=None):
    mouse_pt = mouse_to_tile(event.pos, view.tile_width, view.tile_height)
    tile_view_pt = view.viewport_to_world(mouse_pt)
    if event.button == mouse_buttons.LEFT and entity_select:
-      if is_background_tile(entity_select):
-         world.set_background(tile_view_pt,
-            entities.Background(entity_select,
-               image_store.get_images(i_store, entity_select)))
-         return [tile_view_pt]
-      else:
-         new_entity = create_new_entity(tile_view_pt, entity_select, i_store)
-         if new_entity:
-            world.remove_entity_at(tile_view_pt)
-            world.add_entity(new_entity)
-            return [tile_view_pt]
+      edit = entity_select
    elif event.button == mouse_buttons.RIGHT:
-      world.remove_entity_at(tile_view_pt)
-      return [tile_view_pt]
+      edit = None
+   else:
+      return
 
-   return []
+   edit_tile(world, tile_view_pt, edit, i_store)
+   if recorder is not None:
+      recorder.record_edit(tile_view_pt, edit)
+
+
+def edit_tile(world, pt, entity_select, i_store):
+   if entity_select is None:
+      world.remove_entity_at(pt)
+   elif is_background_tile(entity_select):
+      world.set_background(pt, entities.Background(entity_select,
+         image_store.get_images(i_store, entity_select)))
+   else:
+      new_entity = create_new_entity(pt, entity_select, i_store)
+      if new_entity:
+         world.remove_entity_at(pt)
+         world.add_entity(new_entity)
 
 
 def on_keydown(event, world, entity_select, i_store):
@@ -85,9 +103,12 @@ def on_keydown(event, world, entity_select, i_store):
    return ((x_delta, y_delta), entity_select)
 
 
-def handle_keydown(view, event, i_store, world, entity_select):
+def handle_keydown(view, event, i_store, world, entity_select,
+   recorder=None):
    (view_delta, entity_select) = on_keydown(event, world,
       entity_select, i_store)
+   if event.key == keys.LOAD_KEY and recorder is not None:
+      recorder.record_load(WORLD_FILE_NAME)
    view.update_view(view_delta, image_store.get_images(i_store,
       entity_select)[0])
 
@@ -100,19 +121,18 @@ def create_new_entity(pt, entity_select, i_store):
    if entity_select == 'obstacle':
       return entities.Obstacle(name, pt, images)
    elif entity_select == 'miner':
-      return entities.MinerNotFull(name, MINER_LIMIT, pt,
-         random.randint(MINER_RATE_MIN, MINER_RATE_MAX),
-         images, MINER_ANIMATION_RATE)
+      return entities.MinerNotFull(name, pt, images, MINER_ANIMATION_RATE,
+         random.randint(MINER_RATE_MIN, MINER_RATE_MAX), MINER_LIMIT)
    elif entity_select == 'vein':
-      return entities.Vein(name,
-         random.randint(VEIN_RATE_MIN, VEIN_RATE_MAX), pt, images)
+      return entities.Vein(name, pt, images,
+         random.randint(VEIN_RATE_MIN, VEIN_RATE_MAX))
    elif entity_select == 'ore':
       return entities.Ore(name, pt, images,
          random.randint(ORE_RATE_MIN, ORE_RATE_MAX))
    elif entity_select == 'blacksmith':
       return entities.Blacksmith(name, pt, images,
-         random.randint(SMITH_LIMIT_MIN, SMITH_LIMIT_MAX),
-         random.randint(SMITH_RATE_MIN, SMITH_RATE_MAX))
+         random.randint(SMITH_RATE_MIN, SMITH_RATE_MAX),
+         random.randint(SMITH_LIMIT_MIN, SMITH_LIMIT_MAX))
    else:
       return None
 
@@ -121,21 +141,24 @@ def is_background_tile(entity_select):
    return entity_select in BACKGROUND_TAGS
 
 
-def activity_loop(view, world, i_store):
+def activity_loop(view, world, i_store, recorder=None):
    pygame.key.set_repeat(keys.KEY_DELAY, keys.KEY_INTERVAL)
 
    entity_select = None
    while 1:
       for event in pygame.event.get():
          if event.type == pygame.QUIT:
+            finish_saves()
+            if recorder is not None:
+               recorder.close()
             return
          elif event.type == pygame.MOUSEMOTION:
             handle_mouse_motion(view, event)
          elif event.type == pygame.MOUSEBUTTONDOWN:
-            tiles = handle_mouse_button(view, world, event, entity_select,
-               i_store)
-            view.update_view_tiles(tiles)
+            handle_mouse_button(view, world, event, entity_select, i_store,
+               recorder)
+            view.flush_dirty()
          elif event.type == pygame.KEYDOWN:
             entity_select = handle_keydown(view, event, i_store, world,
-               entity_select)
+               entity_select, recorder)
 
@@ -0,0 +1,398 @@
+import array
+import entities
+import image_store
+import occ_grid
+import os
+import point
+import save_load
+import spatial_index
+import sys
+import worldmodel
+
+CHUNK_SIZE = 32
+STREAM_MARGIN = 1
+EVICT_AFTER = 50
+
+MANIFEST_FILE = 'manifest'
+MANIFEST_KEY = 'chunked'
+MANIFEST_VERSION = 1
+CHUNK_FILE = 'chunk_%d_%d' + save_load.BINARY_EXTENSION
+
+SUMMARY_CLASSES = {
+   save_load.MINER_KEY: entities.MinerNotFull,
+   save_load.VEIN_KEY: entities.Vein,
+   save_load.ORE_KEY: entities.Ore,
+   save_load.SMITH_KEY: entities.Blacksmith,
+   save_load.OBSTACLE_KEY: entities.Obstacle}
+
+# A world kept in a directory of fixed-size chunks, each saved in the binary
+# world format.  A chunk is read the first time one of its tiles is touched,
+# whether by the view, by an entity looking around, or by find_nearest
+# following a summary.  update_streaming loads the chunks around a rect and
+# writes back and drops chunks that have not been touched for EVICT_AFTER
+# calls, so long as none of their entities has a pending action.
+#
+# A dropped chunk leaves behind only a summary: one Ghost per saved entity,
+# kept in a spatial index so that searches still see what the chunk holds.
+# The summaries are written to the manifest by flush.  is_loaded and
+# get_ghost let an overview such as the minimap show a tile without
+# loading its chunk.
+#
+# A world opened to run loads every chunk whose summary holds a miner, vein
+# or ore straight away, so that they are scheduled wherever the view is.
+# Their pending actions then keep those chunks from being evicted.
+
+class Chunk:
+   def __init__(self, left, top, width, height, background):
+      self.left = left
+      self.top = top
+      self.width = width
+      self.height = height
+      self.background = occ_grid.BackgroundGrid(width, height, background)
+      self.occupancy = occ_grid.OccupancyGrid(width, height)
+      self.dirty = False
+      self.generation = 0
+
+   def get_entities(self):
+      return [entity for entity in self.occupancy.entities
+         if entity is not None]
+
+
+class Ghost:
+   __slots__ = ('position', 'chunk', 'cls')
+
+   def __init__(self, position, chunk, cls):
+      self.position = position
+      self.chunk = chunk
+      self.cls = cls
+
+   def get_position(self):
+      return self.position
+
+
+# Presents one grid of every chunk as a single grid over the whole world,
+# loading chunks as their tiles are used.
+class ChunkLayer:
+   def __init__(self, world, layer):
+      self.world = world
+      self.layer = layer
+      self.width = world.num_cols
+      self.height = world.num_rows
+
+   def get_chunk(self, x, y):
+      size = self.world.chunk_size
+      return self.world.get_chunk(x // size, y // size)
+
+   def local_point(self, chunk, pt):
+      return point.Point(pt.x - chunk.left, pt.y - chunk.top)
+
+   def get_cell(self, pt):
+      chunk = self.get_chunk(pt.x, pt.y)
+      return getattr(chunk, self.layer).get_cell(self.local_point(chunk, pt))
+
+   def set_cell(self, pt, value):
+      chunk = self.get_chunk(pt.x, pt.y)
+      chunk.dirty = True
+      getattr(chunk, self.layer).set_cell(self.local_point(chunk, pt), value)
+
+   def is_occupied(self, pt):
+      chunk = self.get_chunk(pt.x, pt.y)
+      return getattr(chunk, self.layer).is_occupied(
+         self.local_point(chunk, pt))
+
+   def first_free_in_window(self, left, top, width, height):
+      (left, top, right, bottom) = occ_grid.clip(self, left, top, width,
+         height)
+      for y in range(top, bottom):
+         for x in range(left, right):
+            if not self.is_occupied(point.Point(x, y)):
+               return (x, y)
+      return None
+
+   def fill_region(self, left, top, width, height, value):
+      (left, top, right, bottom) = occ_grid.clip(self, left, top, width,
+         height)
+      size = self.world.chunk_size
+      for cy in range(top // size, (bottom - 1) // size + 1):
+         for cx in range(left // size, (right - 1) // size + 1):
+            chunk = self.world.get_chunk(cx, cy)
+            chunk.dirty = True
+            (c_left, c_top, c_right, c_bottom) = (max(left, chunk.left),
+               max(top, chunk.top), min(right, chunk.left + chunk.width),
+               min(bottom, chunk.top + chunk.height))
+            getattr(chunk, self.layer).fill_region(c_left - chunk.left,
+               c_top - chunk.top, c_right - c_left, c_bottom - c_top, value)
+
+   def set_row_runs(self, y, runs, palette):
+      x = 0
+      for i in range(0, len(runs), 2):
+         self.fill_region(x, y, runs[i], 1, palette[runs[i + 1]])
+         x += runs[i]
+
+
+class ChunkedWorldModel(worldmodel.WorldModel):
+   def __init__(self, directory, num_rows, num_cols, background, i_store,
+      chunk_size=CHUNK_SIZE, run=False):
+      self.directory = directory
+      self.chunk_size = chunk_size
+      self.chunk_cols = (num_cols + chunk_size - 1) // chunk_size
+      self.chunk_rows = (num_rows + chunk_size - 1) // chunk_size
+      self.default_background = background
+      self.backgrounds = {background.get_name(): background}
+      self.i_store = i_store
+      self.run = run
+      self.generation = 0
+      self.chunks = {}
+      self.summaries = {}
+      self.ghost_tiles = {}
+      worldmodel.WorldModel.__init__(self, num_rows, num_cols, background)
+      self.index = spatial_index.SpatialIndex(num_cols, num_rows, chunk_size)
+      self.ghosts = spatial_index.SpatialIndex(num_cols, num_rows, chunk_size)
+      self.distance_fields = {}
+
+   def create_grids(self, background):
+      point.reserve(self.chunk_size, self.chunk_size)
+      self.background = ChunkLayer(self, 'background')
+      self.occupancy = ChunkLayer(self, 'occupancy')
+
+   def get_chunk(self, cx, cy):
+      chunk = self.chunks.get((cx, cy))
+      if chunk is None:
+         chunk = self.load_chunk(cx, cy)
+      chunk.generation = self.generation
+      return chunk
+
+   def is_loaded(self, pt):
+      size = self.chunk_size
+      return (pt.x // size, pt.y // size) in self.chunks
+
+   def get_ghost(self, pt):
+      return self.ghost_tiles.get(pt)
+
+   def chunk_filename(self, cx, cy):
+      return os.path.join(self.directory, CHUNK_FILE % (cx, cy))
+
+   def get_background_named(self, name):
+      bgnd = self.backgrounds.get(name)
+      if bgnd is None:
+         bgnd = entities.Background(name,
+            image_store.get_images(self.i_store, name))
+         self.backgrounds[name] = bgnd
+      return bgnd
+
+   def load_chunk(self, cx, cy):
+      left = cx * self.chunk_size
+      top = cy * self.chunk_size
+      chunk = Chunk(left, top, min(self.chunk_size, self.num_cols - left),
+         min(self.chunk_size, self.num_rows - top), self.default_background)
+      self.chunks[(cx, cy)] = chunk
+      self.forget_summary((cx, cy))
+
+      filename = self.chunk_filename(cx, cy)
+      if os.path.exists(filename):
+         with open(filename, 'rb') as file:
+            snapshot = save_load.read_snapshot_binary(file)
+         chunk.background.load([self.get_background_named(name)
+            for name in snapshot.palette], snapshot.tiles)
+         for record in snapshot.records:
+            save_load.add_entity(self, save_load.get_record_properties(record),
+               self.i_store, self.run, self.ticks)
+         chunk.dirty = False
+      if self.subscribers:
+         self.publish(worldmodel.CHUNK_LOADED, point.Point(left, top))
+      return chunk
+
+   def save_chunk(self, key, chunk):
+      (palette, tiles) = chunk.background.copy()
+      records = [save_load.get_entity_record(entity)
+         for entity in self.chunk_entities(chunk)]
+      save_load.write_snapshot_file(save_load.WorldSnapshot(chunk.width,
+         chunk.height, [bgnd.get_name() for bgnd in palette], tiles,
+         [record for record in records if record]),
+         self.chunk_filename(key[0], key[1]))
+      chunk.dirty = False
+
+   def chunk_entities(self, chunk):
+      return sorted(chunk.get_entities(), key=self.entities.get_id)
+
+   def is_idle(self, chunk):
+      for entity in chunk.get_entities():
+         if (isinstance(entity, entities.Actionable) and
+            entity.get_pending_actions()):
+            return False
+         if save_load.get_entity_record(entity) is None:
+            return False
+      return True
+
+   def evict_chunk(self, key, chunk):
+      if chunk.dirty:
+         self.save_chunk(key, chunk)
+      ghosts = []
+      for entity in self.chunk_entities(chunk):
+         record = save_load.get_entity_record(entity)
+         ghosts.append(Ghost(entity.get_position(), key,
+            SUMMARY_CLASSES[record[0]]))
+         self.entities.remove(entity)
+         self.index.remove(entity, entity.get_position())
+      del self.chunks[key]
+      self.add_summary(key, ghosts)
+
+   def add_summary(self, key, ghosts):
+      self.summaries[key] = ghosts
+      for (i, ghost) in enumerate(ghosts):
+         self.ghosts.add(ghost, ghost.position, i, ghost.cls)
+         self.ghost_tiles[ghost.position] = ghost
+
+   def forget_summary(self, key):
+      for ghost in self.summaries.pop(key, []):
+         self.ghosts.remove(ghost, ghost.position, ghost.cls)
+         self.ghost_tiles.pop(ghost.position, None)
+
+   def update_streaming(self, rect=None):
+      self.generation += 1
+      if rect is not None:
+         size = self.chunk_size
+         for cy in range(max(rect.top // size - STREAM_MARGIN, 0),
+            min((rect.bottom - 1) // size + STREAM_MARGIN,
+            self.chunk_rows - 1) + 1):
+            for cx in range(max(rect.left // size - STREAM_MARGIN, 0),
+               min((rect.right - 1) // size + STREAM_MARGIN,
+               self.chunk_cols - 1) + 1):
+               self.get_chunk(cx, cy)
+
+      for (key, chunk) in list(self.chunks.items()):
+         if (self.generation - chunk.generation > EVICT_AFTER and
+            self.is_idle(chunk)):
+            self.evict_chunk(key, chunk)
+
+   def find_nearest(self, pt, type):
+      while True:
+         nearest = self.index.nearest(pt, type)
+         ghost = self.ghosts.nearest(pt, type)
+         if ghost is None or (nearest is not None and
+            worldmodel.distance_sq(pt, nearest.get_position()) <=
+            worldmodel.distance_sq(pt, ghost.position)):
+            return nearest
+         self.get_chunk(ghost.chunk[0], ghost.chunk[1])
+
+   def flush(self):
+      summaries = dict(self.summaries)
+      for (key, chunk) in self.chunks.items():
+         if chunk.dirty:
+            self.save_chunk(key, chunk)
+         records = [save_load.get_entity_record(entity)
+            for entity in self.chunk_entities(chunk)]
+         summaries[key] = [Ghost(point.Point(record[2], record[3]), key,
+            SUMMARY_CLASSES[record[0]]) for record in records if record]
+      write_manifest(self.directory, self.num_cols, self.num_rows,
+         self.chunk_size, self.default_background.get_name(), summaries)
+
+
+def write_manifest(directory, num_cols, num_rows, chunk_size, background_name,
+   summaries):
+   filename = os.path.join(directory, MANIFEST_FILE)
+   tmp_filename = filename + '.tmp'
+   with open(tmp_filename, 'w') as file:
+      file.write('%s %d %d %d %d %s\n' % (MANIFEST_KEY, MANIFEST_VERSION,
+         num_cols, num_rows, chunk_size, background_name))
+      names = dict((cls, key) for (key, cls) in SUMMARY_CLASSES.items())
+      for (key, ghosts) in sorted(summaries.items()):
+         for ghost in ghosts:
+            file.write('%d %d %s %d %d\n' % (key[0], key[1],
+               names[ghost.cls], ghost.position.x, ghost.position.y))
+      file.flush()
+      os.fsync(file.fileno())
+   os.replace(tmp_filename, filename)
+
+
+def create_world(directory, num_rows, num_cols, i_store,
+   chunk_size=CHUNK_SIZE, run=False):
+   if not os.path.isdir(directory):
+      os.makedirs(directory)
+   write_manifest(directory, num_cols, num_rows, chunk_size,
+      image_store.DEFAULT_IMAGE_NAME, {})
+   return open_world(directory, i_store, run)
+
+
+def open_world(directory, i_store, run=False):
+   with open(os.path.join(directory, MANIFEST_FILE)) as file:
+      header = file.readline().split()
+      if (len(header) != 6 or header[0] != MANIFEST_KEY or
+         int(header[1]) != MANIFEST_VERSION):
+         raise ValueError('not a version %d chunked world' % MANIFEST_VERSION)
+      (num_cols, num_rows, chunk_size) = [int(value) for value in header[2:5]]
+      background = entities.Background(header[5],
+         image_store.get_images(i_store, header[5]))
+      world = ChunkedWorldModel(directory, num_rows, num_cols, background,
+         i_store, chunk_size, run)
+
+      summaries = {}
+      for line in file:
+         properties = line.split()
+         key = (int(properties[0]), int(properties[1]))
+         summaries.setdefault(key, []).append(Ghost(
+            point.Point(int(properties[3]), int(properties[4])), key,
+            SUMMARY_CLASSES[properties[2]]))
+      for (key, ghosts) in summaries.items():
+         world.add_summary(key, ghosts)
+
+   if run:
+      for key in sorted(summaries):
+         if is_active(summaries[key]):
+            world.get_chunk(key[0], key[1])
+   return world
+
+
+def is_active(ghosts):
+   for ghost in ghosts:
+      if issubclass(ghost.cls, entities.Actionable):
+         return True
+   return False
+
+
+def import_world(world, directory, chunk_size=CHUNK_SIZE):
+   if not os.path.isdir(directory):
+      os.makedirs(directory)
+   snapshot = save_load.take_snapshot(world)
+   chunk_records = {}
+   for record in snapshot.records:
+      chunk_records.setdefault((record[2] // chunk_size,
+         record[3] // chunk_size), []).append(record)
+
+   summaries = {}
+   for top in range(0, world.num_rows, chunk_size):
+      for left in range(0, world.num_cols, chunk_size):
+         width = min(chunk_size, world.num_cols - left)
+         height = min(chunk_size, world.num_rows - top)
+         tiles = array.array('H')
+         for y in range(top, top + height):
+            start = y * world.num_cols
+            tiles.extend(snapshot.tiles[start + left:start + left + width])
+         key = (left // chunk_size, top // chunk_size)
+         records = chunk_records.get(key, [])
+         save_load.write_snapshot_file(save_load.WorldSnapshot(width, height,
+            snapshot.palette, tiles, records),
+            os.path.join(directory, CHUNK_FILE % key))
+         summaries[key] = [Ghost(point.Point(record[2], record[3]), key,
+            SUMMARY_CLASSES[record[0]]) for record in records]
+
+   write_manifest(directory, world.num_cols, world.num_rows, chunk_size,
+      snapshot.palette[0], summaries)
+
+
+def main(argv):
+   if len(argv) < 5:
+      print('usage: chunked_world.py world_file num_cols num_rows directory '
+         '[chunk_size]')
+      return
+   i_store = image_store.load_placeholder_images('imagelist')
+   name = image_store.DEFAULT_IMAGE_NAME
+   world = worldmodel.WorldModel(int(argv[3]), int(argv[2]),
+      entities.Background(name, image_store.get_images(i_store, name)))
+   save_load.load_world_file(world, i_store, argv[1])
+   import_world(world, argv[4],
+      int(argv[5]) if len(argv) > 5 else CHUNK_SIZE)
+
+
+if __name__ == '__main__':
+   main(sys.argv)
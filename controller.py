@@ -1,4 +1,7 @@
+import keys
 import pygame
+import time
+import timewarp
 import worldview
 import worldmodel
 import point
@@ -7,6 +10,15 @@ KEY_DELAY = 400
 KEY_INTERVAL = 100
 
 TIMER_FREQUENCY = 100
+UPDATE_TIME_BUDGET = 0.02
+UPDATE_MAX_ACTIONS = None
+WARP_TIME_BUDGET = 0.08
+LAG_CAPTION = 'behind by %d ms, %d actions due'
+
+WARP_SPEEDS = [1, 4, 16, 64, 256]
+JUMP_TICKS = 3600000
+WARP_CAPTION = 'x%d: %d s simulated, %d actions/s'
+PROGRESS_CAPTION = 'simulating %d of %d s, %d actions/s'
 
 def on_keydown(event):
    x_delta = 0
@@ -23,9 +35,75 @@ def mouse_to_tile(pos, tile_width, tile_height):
    return point.Point(pos[0] // tile_width, pos[1] // tile_height)
 
 
-def handle_timer_event(world, view):
-   rects = world.update_on_time(pygame.time.get_ticks())
-   view.update_view_tiles(rects)
+def handle_timer_event(world, view, clock, recorder=None):
+   ticks = clock.get_ticks(pygame.time.get_ticks())
+   if clock.speed > 1:
+      # A warp step gets most of a timer period, so keys are still handled
+      # between steps.  If it falls short the clock is held back to where
+      # the world got to rather than running further ahead.
+      start = time.perf_counter()
+      dispatched = timewarp.fast_forward(world, ticks, None, recorder,
+         view.viewport, WARP_TIME_BUDGET)
+      if world.ticks < ticks:
+         clock.set_speed(clock.speed, pygame.time.get_ticks(), world.ticks)
+      elapsed = max(time.perf_counter() - start, 1e-6)
+      pygame.display.set_caption(WARP_CAPTION % (clock.speed,
+         world.ticks // 1000, dispatched / elapsed))
+      return
+
+   world.update_on_time(ticks, UPDATE_MAX_ACTIONS, UPDATE_TIME_BUDGET)
+   if recorder is not None:
+      recorder.record_tick(ticks, world.dispatched, view.viewport)
+   world.update_streaming(view.viewport)
+   view.update_view_tiles(view.get_animated_tiles())
+   show_lag(world)
+
+
+def show_lag(world):
+   caption = LAG_CAPTION % (world.lag, world.backlog) if world.lag else ''
+   # pygame gives an empty tuple rather than ('',) for an empty caption.
+   if (pygame.display.get_caption() or ('',))[0] != caption:
+      pygame.display.set_caption(caption)
+
+
+def show_progress(ticks, end, dispatched, elapsed):
+   # Cancels the run on WARP_KEY, or on QUIT, which is posted again for the
+   # activity loop.  Other key presses are put back to wait for the loop.
+   pygame.display.set_caption(PROGRESS_CAPTION % (ticks // 1000, end // 1000,
+      dispatched / elapsed))
+   cancel = False
+   for event in pygame.event.get((pygame.QUIT, pygame.KEYDOWN)):
+      if event.type == pygame.QUIT:
+         pygame.event.post(event)
+         cancel = True
+      elif event.key == keys.WARP_KEY:
+         cancel = True
+      else:
+         pygame.event.post(event)
+   return cancel
+
+
+def set_warp(world, view, clock, speed):
+   # The view is suspended while warping and redrawn once when it ends.
+   wall = pygame.time.get_ticks()
+   if speed > 1:
+      view.suspend()
+      clock.set_speed(speed, wall)
+   else:
+      clock.set_speed(speed, wall, world.ticks)
+      view.resume()
+      show_lag(world)
+
+
+def jump_to(world, view, clock, ticks, recorder=None):
+   warping = clock.speed > 1
+   view.suspend()
+   timewarp.fast_forward(world, ticks, show_progress, recorder,
+      view.viewport)
+   clock.jump(world.ticks, pygame.time.get_ticks())
+   if not warping:
+      view.resume()
+      show_lag(world)
 
 
 def handle_mouse_motion(view, event):
@@ -33,23 +111,45 @@ def handle_mouse_motion(view, event):
    view.mouse_move(mouse_pt)
 
 
-def handle_keydown(view, event):
-   view_delta = on_keydown(event)
-   view.update_view(view_delta)
+def handle_mouse_button(view, event):
+   overlay = view.overlay_at(event.pos)
+   if overlay is not None:
+      overlay.click(event.pos)
+
+
+def handle_keydown(view, event, world, clock, recorder=None):
+   if event.key == keys.WARP_KEY:
+      speed = WARP_SPEEDS[(WARP_SPEEDS.index(clock.speed) + 1) %
+         len(WARP_SPEEDS)]
+      set_warp(world, view, clock, speed)
+   elif event.key == keys.JUMP_KEY:
+      jump_to(world, view, clock, world.ticks + JUMP_TICKS, recorder)
+   elif event.key == keys.ZOOM_IN_KEY:
+      view.zoom(1)
+   elif event.key == keys.ZOOM_OUT_KEY:
+      view.zoom(-1)
+   else:
+      view_delta = on_keydown(event)
+      view.update_view(view_delta)
 
 
-def activity_loop(view, world):
+def activity_loop(view, world, recorder=None):
    pygame.key.set_repeat(KEY_DELAY, KEY_INTERVAL)
    pygame.time.set_timer(pygame.USEREVENT, TIMER_FREQUENCY)
+   clock = timewarp.SimulationClock(pygame.time.get_ticks())
 
    while 1:
       for event in pygame.event.get():
          if event.type == pygame.QUIT:
+            if recorder is not None:
+               recorder.close()
             return
          elif event.type == pygame.USEREVENT:
-            handle_timer_event(world, view)
+            handle_timer_event(world, view, clock, recorder)
          elif event.type == pygame.MOUSEMOTION:
             handle_mouse_motion(view, event)
+         elif event.type == pygame.MOUSEBUTTONDOWN:
+            handle_mouse_button(view, event)
          elif event.type == pygame.KEYDOWN:
-            handle_keydown(view, event)
+            handle_keydown(view, event, world, clock, recorder)
 
@@ -0,0 +1,107 @@
+import chunked_world
+import entities
+import image_store
+import instrumentation
+import os
+import random
+import save_load
+import sys
+import time
+import worldmodel
+
+IMAGE_LIST_FILE_NAME = 'imagelist'
+WORLD_FILE = 'gaia.sav'
+
+NUM_COLS = 40
+NUM_ROWS = 30
+
+STEP = 100
+RUN_SECONDS = 60
+
+# Advances a WorldModel on a simulated clock without pygame.  Images are
+# image_store.PlaceholderImage objects, which keep the per-key frame counts
+# the animations depend on but hold no pixels.
+
+class Engine:
+   def __init__(self, world, ticks=0):
+      self.world = world
+      self.ticks = ticks
+
+   def step(self, delta=STEP):
+      self.ticks += delta
+      return self.world.update_on_time(self.ticks)
+
+   def run_fixed_step(self, end, delta=STEP):
+      tiles = []
+      while self.ticks + delta <= end:
+         tiles.extend(self.step(delta))
+      return tiles
+
+   def run_next_due(self, end):
+      tiles = []
+      for (self.ticks, changed) in run_due_actions(self.world, self.ticks,
+         end):
+         tiles.extend(changed)
+      self.ticks = max(self.ticks, end)
+      return tiles
+
+
+def run_due_actions(world, ticks, end):
+   # Stops the clock at each due time before end in turn, yielding the tick
+   # and the tiles update_on_time returned.  update_on_time only dispatches
+   # actions due strictly before the tick it is given, so each jump lands
+   # one millisecond past the due time.
+   next_time = world.next_action_time()
+   while next_time is not None and next_time < end:
+      ticks = max(ticks, next_time + 1)
+      yield (ticks, world.update_on_time(ticks))
+      next_time = world.next_action_time()
+
+
+def create_default_background(i_store):
+   return entities.Background(image_store.DEFAULT_IMAGE_NAME,
+      image_store.get_images(i_store, image_store.DEFAULT_IMAGE_NAME))
+
+
+def create_world(i_store, num_rows=NUM_ROWS, num_cols=NUM_COLS):
+   return worldmodel.WorldModel(num_rows, num_cols,
+      create_default_background(i_store))
+
+
+def load_world(world, i_store, filename, run=True):
+   save_load.load_world_file(world, i_store, filename, run)
+
+
+def create_engine(filename=WORLD_FILE, num_rows=NUM_ROWS, num_cols=NUM_COLS):
+   i_store = image_store.load_placeholder_images(IMAGE_LIST_FILE_NAME)
+   if os.path.isdir(filename):
+      world = chunked_world.open_world(filename, i_store, True)
+   else:
+      world = create_world(i_store, num_rows, num_cols)
+      load_world(world, i_store, filename)
+   return Engine(world)
+
+
+def main(argv):
+   random.seed()
+   seconds = int(argv[1]) if len(argv) > 1 else RUN_SECONDS
+   filename = argv[2] if len(argv) > 2 else WORLD_FILE
+   profile_file = argv[3] if len(argv) > 3 else None
+
+   engine = create_engine(filename)
+   if profile_file:
+      profiler = instrumentation.ActionProfiler()
+      engine.world.set_profiler(profiler)
+   start = time.time()
+   engine.run_next_due(seconds * 1000)
+   elapsed = time.time() - start
+
+   print('simulated %d s in %.3f s, %d entities' %
+      (seconds, elapsed, len(engine.world.get_entities())))
+   if profile_file:
+      sys.stdout.write(profiler.summary())
+      profiler.dump(profile_file)
+
+
+if __name__ == '__main__':
+   main(sys.argv)
@@ -15,13 +15,15 @@ QUAKE_ANIMATION_RATE = 100
 #Remove entity - look into when it's used.
 
 class Background(object):
+   __slots__ = ('name', 'imgs', 'current_img')
+
    def __init__(self, name, imgs):
       self.name = name
       self.imgs = imgs
       self.current_img = 0
 
    def get_name(self):
-      return self.get_background(point.Point(col, row))
+      return self.name
 
    def get_images(self):
       return self.imgs
@@ -31,6 +33,8 @@ class Background(object):
 
 
 class Entity(object):
+   __slots__ = ('name', 'position', 'imgs', 'current_img')
+
    def __init__(self, name, position, imgs):
       self.name = name
       self.position = position
@@ -54,26 +58,32 @@ class Entity(object):
 
 
 class Obstacle(Entity):
+   __slots__ = ()
+
    def __init__(self, name, position, imgs):
       self.name = name
       self.position = position
       self.imgs = imgs
       self.current_img = 0
 
-   def entity_string(self): 
-      return ' '.join(['obstacle', entity.name, str(entity.position.x),
-         str(entity.position.y)])
+   def entity_string(self):
+      return ' '.join(['obstacle', self.name, str(self.position.x),
+         str(self.position.y)])
 
 
 class RemovableEntity(Entity):
+   __slots__ = ()
+
    def remove_entity(self, world):
-      for action in self.get_pending_actions():
-         world.unschedule_action(action)
+      for handle in self.get_pending_actions():
+         world.unschedule_action(handle)
       self.clear_pending_actions()
       world.remove_entity(self)
 
 
 class HasARate(object):
+   __slots__ = ()
+
    def __init__(self, rate):
       self.rate = rate
 
@@ -81,64 +91,73 @@ class HasARate(object):
       return self.rate
 
 
+# Animation frames are derived from the world clock rather than stepped by
+# queued actions: the image advances every animation_rate ms after
+# start_animation, and stops after repeat_count advances unless it is 0.
 class Animated(object):
+   __slots__ = ()
+
    def __init__(self, animation_rate):
       self.animation_rate = animation_rate
+      self.animation_start = 0
+      self.repeat_count = 0
 
    def get_animation_rate(self):
       return self.animation_rate
 
-   def create_animation_action(self, world, repeat_count):
-      def action(current_ticks):
-         self.remove_pending_action(action)
-
-         self.next_image()
-
-         if repeat_count != 1:
-            self.schedule_action(world,
-               self.create_animation_action(world, max(repeat_count - 1, 0)),
-               current_ticks + self.get_animation_rate())
-
-         return [self.get_position()]
-      return action
-
-   def next_image(self):
-      self.current_img = (self.current_img + 1) % len(self.imgs)
+   def start_animation(self, ticks, repeat_count=0):
+      self.animation_start = ticks
+      self.repeat_count = repeat_count
 
-   def schedule_animation(self, world, repeat_count=0):
-      self.schedule_action(world,
-         self.create_animation_action(world, repeat_count),
-         self.get_animation_rate())
+   def get_image_at(self, ticks):
+      steps = max(ticks - self.animation_start, 0) // self.animation_rate
+      if self.repeat_count:
+         steps = min(steps, self.repeat_count)
+      return self.imgs[(self.current_img + steps) % len(self.imgs)]
 
 
 class Actionable(object):
+   __slots__ = ()
+
    def __init__(self):
-      self.pending_actions = []
+      self.pending_actions = {}
+      self.action = None
    
    def get_pending_actions(self):
-      if hasattr(self, "pending_actions"):
-         return self.pending_actions
-      else:
-         return []
+      return self.pending_actions.values()
 
-   def add_pending_action(self, action):
-      if hasattr(self, "pending_actions"):
-         self.pending_actions.append(action)
+   def add_pending_action(self, action, handle):
+      self.pending_actions[action] = handle
 
    def remove_pending_action(self, action):
-      if hasattr(self, "pending_actions"):
-         self.pending_actions.remove(action)
+      self.pending_actions.pop(action, None)
 
    def clear_pending_actions(self):
-      if hasattr(self, "pending_actions"):
-         self.pending_actions = []
+      self.pending_actions = {}
+
+   def get_action(self, cls, world, i_store=None):
+      action = self.action
+      if action is None or action.__class__ is not cls:
+         action = self.action = cls(self, world, i_store)
+      return action
 
    def schedule_action(self, world, action, time):
-      self.add_pending_action(action)
-      world.schedule_action(action, time)
+      # Pending actions are keyed by the action object, which is reused
+      # from step to step, so scheduling one that is already pending moves
+      # it to the new time instead of queueing a second copy whose handle
+      # would be lost.
+      handle = self.pending_actions.get(action)
+      if handle is not None:
+         world.unschedule_action(handle)
+      self.add_pending_action(action,
+         world.schedule_action(action, time, self))
 
 
 class Miner(Entity, Animated, Actionable, HasARate):
+   __slots__ = ('animation_rate', 'animation_start', 'repeat_count',
+      'action', 'pending_actions', 'rate', 'resource_limit',
+      'resource_count')
+
    def __init__(self, name, position, imgs, animation_rate, rate, resource_limit):
       Entity.__init__(self, name, position, imgs)
       Animated.__init__(self, animation_rate)
@@ -158,10 +177,10 @@ class Miner(Entity, Animated, Actionable, HasARate):
    def try_transform_miner(self, world, transform):
       new_entity = transform(world)
       if self != new_entity:
-         world.clear_pending_actions(self)
-         world.remove_entity_at(self.get_position())
-         world.add_entity(new_entity)
-         new_entity.schedule_animation(world)
+         # A miner that is no longer on its tile stays as it is.
+         if not world.replace_entity(self, new_entity):
+            return self
+         new_entity.start_animation(world.ticks)
 
       return new_entity
 
@@ -171,10 +190,12 @@ class Miner(Entity, Animated, Actionable, HasARate):
    def schedule_miner(self, world, ticks, i_store):
       self.schedule_action(world, self.create_miner_action(world, i_store),
          ticks + self.get_rate())
-      self.schedule_animation(world)
+      self.start_animation(ticks)
    
 
 class MinerNotFull(Miner):
+   __slots__ = ()
+
    def __init__(self, name, position, imgs, animation_rate, rate, resource_limit):
       Miner.__init__(self, name, position, imgs, animation_rate, rate, resource_limit)
       self.resource_count = 0
@@ -190,23 +211,22 @@ class MinerNotFull(Miner):
          return new_entity
 
    def create_miner_specific_action(self, world, i_store):
-      def action(current_ticks):
-         self.remove_pending_action(action)
+      return self.get_action(actions.MinerAction, world, i_store)
 
-         entity_pt = self.get_position()
-         ore = world.find_nearest(entity_pt, Ore)
-         (tiles, found) = self.miner_to_ore(world, ore)
+   def run_miner_action(self, world, i_store, current_ticks):
+      entity_pt = self.get_position()
+      ore = world.find_nearest(entity_pt, Ore)
+      (tiles, found) = self.miner_to_ore(world, ore)
 
-         new_entity = self
-         if found:
-            new_entity = self.try_transform_miner(world,
-               self.try_transform_miner_not_full)
-   
-         new_entity.schedule_action(world,
-            new_entity.create_miner_action(world, i_store),
-            current_ticks + new_entity.get_rate())
-         return tiles
-      return action
+      new_entity = self
+      if found:
+         new_entity = self.try_transform_miner(world,
+            self.try_transform_miner_not_full)
+
+      new_entity.schedule_action(world,
+         new_entity.create_miner_action(world, i_store),
+         current_ticks + new_entity.get_rate())
+      return tiles
 
    def miner_to_ore(self, world, ore):
       entity_pt = self.get_position()
@@ -224,12 +244,14 @@ class MinerNotFull(Miner):
          return (world.move_entity(self, new_pt), False)
 
    def entity_string(self):
-      return ' '.join(['miner', entity.name, str(entity.position.x),
-         str(entity.position.y), str(entity.resource_limit),
-         str(entity.rate), str(entity.animation_rate)])
+      return ' '.join(['miner', self.name, str(self.position.x),
+         str(self.position.y), str(self.resource_limit),
+         str(self.rate), str(self.animation_rate)])
 
 
 class MinerFull(Miner):
+   __slots__ = ()
+
    def __init__(self, name, position, imgs, animation_rate, rate, resource_limit):
       Miner.__init__(self, name, position, imgs, animation_rate, rate, resource_limit) 
       self.resource_count = resource_limit
@@ -243,23 +265,22 @@ class MinerFull(Miner):
       return new_entity
 
    def create_miner_specific_action(self, world, i_store):
-      def action(current_ticks):
-         self.remove_pending_action(action)
+      return self.get_action(actions.MinerAction, world, i_store)
 
-         entity_pt = self.get_position()
-         smith = world.find_nearest(entity_pt, Blacksmith)
-         (tiles, found) = self.miner_to_smith(world, smith)
+   def run_miner_action(self, world, i_store, current_ticks):
+      entity_pt = self.get_position()
+      smith = world.find_nearest(entity_pt, Blacksmith)
+      (tiles, found) = self.miner_to_smith(world, smith)
 
-         new_entity = self
-         if found:
-            new_entity = self.try_transform_miner(world,
-               self.try_transform_miner_full)
-   
-         new_entity.schedule_action(world,
-            new_entity.create_miner_action(world, i_store),
-            current_ticks + new_entity.get_rate())
-         return tiles
-      return action
+      new_entity = self
+      if found:
+         new_entity = self.try_transform_miner(world,
+            self.try_transform_miner_full)
+
+      new_entity.schedule_action(world,
+         new_entity.create_miner_action(world, i_store),
+         current_ticks + new_entity.get_rate())
+      return tiles
 
    def miner_to_smith(self, world, smith):
       entity_pt = self.get_position()
@@ -273,11 +294,14 @@ class MinerFull(Miner):
          self.set_resource_count(0)
          return ([], True)
       else:
-         new_pt = world.next_position(entity_pt, smith_pt)
+         new_pt = world.path_next_position(entity_pt, smith_pt, Blacksmith)
          return (world.move_entity(self, new_pt), False)
 
 
 class Blacksmith(Entity, HasARate):
+   __slots__ = ('rate', 'resource_limit', 'resource_count',
+      'resource_distance')
+
    def __init__(self, name, position, imgs, rate, resource_limit, resource_distance=1):
       Entity.__init__(self, name, position, imgs)
       HasARate.__init__(self, rate)
@@ -286,9 +310,9 @@ class Blacksmith(Entity, HasARate):
       self.resource_distance = resource_distance
 
    def entity_string(self):
-      return ' '.join(['blacksmith', entity.name, str(entity.position.x),
-         str(entity.position.y), str(entity.resource_limit),
-         str(entity.rate), str(entity.resource_distance)])
+      return ' '.join(['blacksmith', self.name, str(self.position.x),
+         str(self.position.y), str(self.resource_limit),
+         str(self.rate), str(self.resource_distance)])
 
    def set_resource_count(self, n):
       self.resource_count = n
@@ -304,6 +328,8 @@ class Blacksmith(Entity, HasARate):
 
 
 class Vein(RemovableEntity, Actionable, HasARate):
+   __slots__ = ('action', 'pending_actions', 'rate', 'resource_distance')
+
    def __init__(self, name, position, imgs, rate, resource_distance=1):
       RemovableEntity.__init__(self, name, position, imgs)
       Actionable.__init__(self)
@@ -314,30 +340,29 @@ class Vein(RemovableEntity, Actionable, HasARate):
       return self.resource_distance
 
    def entity_string(self):
-      return ' '.join(['vein', entity.name, str(entity.position.x),
-         str(entity.position.y), str(entity.rate),
-         str(entity.resource_distance)])
+      return ' '.join(['vein', self.name, str(self.position.x),
+         str(self.position.y), str(self.rate),
+         str(self.resource_distance)])
 
    def create_vein_action(self, world, i_store):
-      def action(current_ticks):
-         self.remove_pending_action(action)
-
-         open_pt = world.find_open_around(self.get_position(),
-            self.get_resource_distance())
-         if open_pt:
-            ore = world.create_ore(
-               "ore - " + self.get_name() + " - " + str(current_ticks),
-            open_pt, current_ticks, i_store)
-            world.add_entity(ore)
-            tiles = [open_pt]
-         else:
-            tiles = []
-
-         self.schedule_action(world,
-            self.create_vein_action(world, i_store),
-            current_ticks + self.get_rate())
-         return tiles
-      return action
+      return self.get_action(actions.VeinAction, world, i_store)
+
+   def run_vein_action(self, world, i_store, current_ticks):
+      open_pt = world.find_open_around(self.get_position(),
+         self.get_resource_distance())
+      if open_pt:
+         ore = world.create_ore(
+            "ore - " + self.get_name() + " - " + str(current_ticks),
+         open_pt, current_ticks, i_store)
+         world.add_entity(ore)
+         tiles = [open_pt]
+      else:
+         tiles = []
+
+      self.schedule_action(world,
+         self.create_vein_action(world, i_store),
+         current_ticks + self.get_rate())
+      return tiles
 
    def schedule_vein(self, world, ticks, i_store):
       self.schedule_action(world, self.create_vein_action(world, i_store),
@@ -345,28 +370,30 @@ class Vein(RemovableEntity, Actionable, HasARate):
 
 
 class Ore(RemovableEntity, Actionable, HasARate):
+   __slots__ = ('action', 'pending_actions', 'rate')
+
    def __init__(self, name, position, imgs, rate=5000):
       RemovableEntity.__init__(self, name, position, imgs)
       Actionable.__init__(self)
       HasARate.__init__(self, rate)
 
    def entity_string(self):
-      return ' '.join(['ore', entity.name, str(entity.position.x),
-         str(entity.position.y), str(entity.rate)])
+      return ' '.join(['ore', self.name, str(self.position.x),
+         str(self.position.y), str(self.rate)])
 
    def create_ore_transform_action(self, world, i_store):
-      def action(current_ticks):
-         self.remove_pending_action(action)
-         blob = world.create_blob(self.get_name() + " -- blob",
-            self.get_position(),
-            self.get_rate() // BLOB_RATE_SCALE,
-            current_ticks, i_store)
+      return self.get_action(actions.OreTransformAction, world, i_store)
 
-         self.remove_entity(world)
-         world.add_entity(blob)
+   def run_ore_transform_action(self, world, i_store, current_ticks):
+      blob = world.create_blob(self.get_name() + " -- blob",
+         self.get_position(),
+         self.get_rate() // BLOB_RATE_SCALE,
+         current_ticks, i_store)
 
-         return [blob.get_position()]
-      return action
+      self.remove_entity(world)
+      world.add_entity(blob)
+
+      return [blob.get_position()]
 
    def schedule_ore(self, world, ticks, i_store):
       self.schedule_action(world,
@@ -375,6 +402,9 @@ class Ore(RemovableEntity, Actionable, HasARate):
 
 
 class OreBlob(Entity, Animated, Actionable, HasARate):
+   __slots__ = ('animation_rate', 'animation_start', 'repeat_count',
+      'action', 'pending_actions', 'rate')
+
    def __init__(self, name, position, imgs, animation_rate, rate):
       Entity.__init__(self, name, position, imgs)
       Animated.__init__(self, animation_rate)
@@ -382,25 +412,24 @@ class OreBlob(Entity, Animated, Actionable, HasARate):
       HasARate.__init__(self, rate)
 
    def create_ore_blob_action(self, world, i_store):
-      def action(current_ticks):
-         self.remove_pending_action(action)
+      return self.get_action(actions.OreBlobAction, world, i_store)
 
-         entity_pt = self.get_position()
-         vein = world.find_nearest(entity_pt, Vein)
-         (tiles, found) = self.blob_to_vein(world, vein)
+   def run_ore_blob_action(self, world, i_store, current_ticks):
+      entity_pt = self.get_position()
+      vein = world.find_nearest(entity_pt, Vein)
+      (tiles, found) = self.blob_to_vein(world, vein)
 
-         next_time = current_ticks + self.get_rate()
-         if found:
-            quake = world.create_quake(tiles[0], current_ticks, i_store)
-            world.add_entity(quake)
-            next_time = current_ticks + self.get_rate() * 2
+      next_time = current_ticks + self.get_rate()
+      if found:
+         quake = world.create_quake(tiles[0], current_ticks, i_store)
+         world.add_entity(quake)
+         next_time = current_ticks + self.get_rate() * 2
 
-         self.schedule_action(world,
-            self.create_ore_blob_action(world, i_store),
-            next_time)
+      self.schedule_action(world,
+         self.create_ore_blob_action(world, i_store),
+         next_time)
 
-         return tiles
-      return action
+      return tiles
 
    def blob_to_vein(self, world, vein):
       entity_pt = self.get_position()
@@ -411,7 +440,7 @@ class OreBlob(Entity, Animated, Actionable, HasARate):
          vein.remove_entity(world)
          return ([vein_pt], True)
       else:
-         new_pt = world.blob_next_position(entity_pt, vein_pt)
+         new_pt = world.blob_path_next_position(entity_pt, vein_pt, Vein)
          old_entity = world.get_tile_occupant(new_pt)
          if isinstance(old_entity, Ore):
             old_entity.remove_entity(world)
@@ -421,10 +450,12 @@ class OreBlob(Entity, Animated, Actionable, HasARate):
       self.schedule_action(world, self.create_ore_blob_action(world,
          i_store),
          ticks + self.get_rate())
-      self.schedule_animation(world)
+      self.start_animation(ticks)
 
 
 class Quake(RemovableEntity, Animated, Actionable):
+   __slots__ = ('animation_rate', 'animation_start', 'repeat_count',
+      'action', 'pending_actions')
 
    def __init__(self, name, position, imgs, animation_rate):
       RemovableEntity.__init__(self, name, position, imgs)
@@ -432,15 +463,15 @@ class Quake(RemovableEntity, Animated, Actionable):
       Actionable.__init__(self)
 
    def create_entity_death_action(self, world):
-      def action(current_ticks):
-         self.remove_pending_action(action)
-         pt = self.get_position()
-         self.remove_entity(world)
-         return [pt]
-      return action
+      return self.get_action(actions.EntityDeathAction, world)
+
+   def run_entity_death_action(self, world, current_ticks):
+      pt = self.get_position()
+      self.remove_entity(world)
+      return [pt]
 
    def schedule_quake(self, world, ticks):
-      self.schedule_animation(world, QUAKE_STEPS) 
+      self.start_animation(ticks, QUAKE_STEPS) 
       self.schedule_action(world, self.create_entity_death_action(world),
          ticks + QUAKE_DURATION)
 
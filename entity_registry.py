@@ -0,0 +1,66 @@
+import heapq
+
+# Every registered entity gets an increasing integer id.  The dicts below
+# preserve insertion order, so iterating the registry, or one of its
+# per-class views, yields entities in the order they were added.
+
+class EntityRegistry:
+   def __init__(self):
+      self.next_id = 0
+      self.ids = {}
+      self.by_id = {}
+      self.by_class = {}
+      self.by_name = {}
+
+   def __iter__(self):
+      return iter(list(self.by_id.values()))
+
+   def __len__(self):
+      return len(self.by_id)
+
+   def __contains__(self, entity):
+      return entity in self.ids
+
+   def add(self, entity):
+      self.next_id += 1
+      entity_id = self.next_id
+      self.ids[entity] = entity_id
+      self.by_id[entity_id] = entity
+      self.by_class.setdefault(entity.__class__, {})[entity_id] = entity
+      self.by_name.setdefault(entity.get_name(), {})[entity_id] = entity
+      return entity_id
+
+   def remove(self, entity):
+      entity_id = self.ids.pop(entity)
+      del self.by_id[entity_id]
+      remove_from(self.by_class, entity.__class__, entity_id)
+      remove_from(self.by_name, entity.get_name(), entity_id)
+      return entity_id
+
+   def get_id(self, entity):
+      return self.ids.get(entity)
+
+   def get(self, entity_id):
+      return self.by_id.get(entity_id)
+
+   def find_by_name(self, name):
+      named = self.by_name.get(name)
+      return next(iter(named.values())) if named else None
+
+   def all_named(self, name):
+      return list(self.by_name.get(name, {}).values())
+
+   def of_class(self, cls):
+      return list(self.by_class.get(cls, {}).values())
+
+   def of_type(self, type):
+      views = [view.items() for (cls, view) in self.by_class.items()
+         if issubclass(cls, type)]
+      return [entity for (entity_id, entity) in heapq.merge(*views)]
+
+
+def remove_from(views, key, entity_id):
+   view = views[key]
+   del view[entity_id]
+   if not view:
+      del views[key]
@@ -1,8 +1,21 @@
-import pygame
+import collections
+import os
+
+try:
+   import pygame
+except ImportError:
+   pygame = None
 
 DEFAULT_IMAGE_NAME = 'background_default'
 DEFAULT_IMAGE_COLOR = (128, 128, 128, 0)
 
+ATLAS_SUFFIX = '.atlas'
+ATLAS_VERSION = 1
+ATLAS_WIDTH = 512
+ATLAS_PIXELS = b'pixels\n'
+
+SCALED_CACHE_BYTES = 32 * 1024 * 1024
+
 
 def create_default_image(tile_width, tile_height):
    surf = pygame.Surface((tile_width, tile_height))
@@ -11,14 +24,39 @@ def create_default_image(tile_width, tile_height):
 
 
 def load_images(filename, tile_width, tile_height):
+   images = load_atlas(filename)
+   if images is None:
+      try:
+         build_atlas(filename)
+         images = load_atlas(filename)
+      except (IOError, OSError):
+         images = None
+
+   if images is None:
+      images = {}
+      with open(filename) as fstr:
+         for line in fstr:
+            process_image_line(images, line)
+
+   if DEFAULT_IMAGE_NAME not in images:
+      default_image = create_default_image(tile_width, tile_height)
+      images[DEFAULT_IMAGE_NAME] = [default_image]
+
+   return images
+
+
+def load_placeholder_images(filename):
    images = {}
    with open(filename) as fstr:
       for line in fstr:
-         process_image_line(images, line)
+         attrs = line.split()
+         if len(attrs) >= 2:
+            imgs = get_images_internal(images, attrs[0])
+            imgs.append(PlaceholderImage(attrs[0], attrs[1]))
+            images[attrs[0]] = imgs
 
    if DEFAULT_IMAGE_NAME not in images:
-      default_image = create_default_image(tile_width, tile_height)
-      images[DEFAULT_IMAGE_NAME] = [default_image]
+      images[DEFAULT_IMAGE_NAME] = [PlaceholderImage(DEFAULT_IMAGE_NAME, None)]
 
    return images
 
@@ -42,6 +80,121 @@ def process_image_line(images, line):
             img.set_colorkey(pygame.Color(r, g, b, a))
 
 
+# The atlas is a cache next to the image list.  It holds every frame packed
+# into one sheet as raw RGB pixels, so startup reads a single file instead
+# of decoding each bitmap.  The header records the modification time of
+# the image list and of every bitmap; a mismatch rebuilds the cache.
+#
+#   atlas <version> <width> <height>
+#   source <path> <mtime>
+#   frame <key> <x> <y> <width> <height> [<r> <g> <b> <a>]
+#   pixels
+#   <width * height * 3 bytes>
+
+def get_atlas_name(filename):
+   return filename + ATLAS_SUFFIX
+
+
+def read_image_list(filename):
+   entries = []
+   with open(filename) as fstr:
+      for line in fstr:
+         attrs = line.split()
+         if len(attrs) >= 2:
+            entries.append(attrs)
+   return entries
+
+
+def get_sources(filename, entries):
+   paths = [filename]
+   for attrs in entries:
+      if attrs[1] not in paths:
+         paths.append(attrs[1])
+   return [(path, repr(os.path.getmtime(path))) for path in paths]
+
+
+def build_atlas(filename):
+   entries = read_image_list(filename)
+   frames = [(attrs, pygame.image.load(attrs[1])) for attrs in entries]
+
+   placements = []
+   x = y = shelf_height = 0
+   for (attrs, img) in frames:
+      (width, height) = img.get_size()
+      if x + width > ATLAS_WIDTH:
+         x = 0
+         y += shelf_height
+         shelf_height = 0
+      placements.append((attrs, img, x, y))
+      x += width
+      shelf_height = max(shelf_height, height)
+
+   sheet = pygame.Surface((ATLAS_WIDTH, max(y + shelf_height, 1)))
+   lines = ['atlas %d %d %d' % (ATLAS_VERSION, sheet.get_width(),
+      sheet.get_height())]
+   lines.extend('source %s %s' % source
+      for source in get_sources(filename, entries))
+   for (attrs, img, x, y) in placements:
+      sheet.blit(img, (x, y))
+      lines.append(' '.join(['frame', attrs[0], str(x), str(y),
+         str(img.get_width()), str(img.get_height())] + attrs[2:6]))
+
+   atlas_name = get_atlas_name(filename)
+   with open(atlas_name + '.tmp', 'wb') as fstr:
+      fstr.write(('\n'.join(lines) + '\n').encode())
+      fstr.write(ATLAS_PIXELS)
+      fstr.write(pygame.image.tostring(sheet, 'RGB'))
+   os.replace(atlas_name + '.tmp', atlas_name)
+
+
+def load_atlas(filename):
+   try:
+      with open(get_atlas_name(filename), 'rb') as fstr:
+         data = fstr.read()
+   except (IOError, OSError):
+      return None
+
+   # A damaged cache is treated as stale and rebuilt.
+   try:
+      return read_atlas(data)
+   except (IndexError, TypeError, ValueError, pygame.error):
+      return None
+
+
+def read_atlas(data):
+   split = data.find(b'\n' + ATLAS_PIXELS)
+   if split < 0:
+      return None
+   lines = [line.split() for line in data[:split].decode().split('\n')]
+   pixels = data[split + 1 + len(ATLAS_PIXELS):]
+
+   header = lines[0]
+   if header[0] != 'atlas' or int(header[1]) != ATLAS_VERSION:
+      return None
+   size = (int(header[2]), int(header[3]))
+   if len(pixels) != size[0] * size[1] * 3:
+      return None
+   for attrs in lines:
+      if attrs[0] == 'source':
+         try:
+            if repr(os.path.getmtime(attrs[1])) != attrs[2]:
+               return None
+         except OSError:
+            return None
+
+   sheet = pygame.image.fromstring(pixels, size, 'RGB').convert()
+   images = {}
+   for attrs in lines:
+      if attrs[0] == 'frame':
+         img = sheet.subsurface(pygame.Rect([int(v) for v in attrs[2:6]]))
+         imgs = get_images_internal(images, attrs[1])
+         imgs.append(img)
+         images[attrs[1]] = imgs
+         if len(attrs) == 10:
+            img.set_colorkey(pygame.Color(*[int(v) for v in attrs[6:10]]))
+   return images
+
+
 def get_images_internal(images, key):
    if key in images:
       return images[key]
@@ -54,3 +207,47 @@ def get_images(images, key):
       return images[key]
    else:
       return images[DEFAULT_IMAGE_NAME]
+
+
+# Copies of native frames scaled to other tile sizes, made on first use and
+# kept in least recently used order until their pixels pass max_bytes.
+# Frames already at the requested size are returned as they are.
+
+class ScaledImageCache:
+   def __init__(self, max_bytes=SCALED_CACHE_BYTES):
+      self.max_bytes = max_bytes
+      self.images = collections.OrderedDict()
+      self.bytes = 0
+
+   def get(self, img, width, height):
+      if img.get_width() == width and img.get_height() == height:
+         return img
+      key = (img, width, height)
+      scaled = self.images.get(key)
+      if scaled is not None:
+         self.images.move_to_end(key)
+         return scaled
+
+      scaled = pygame.transform.scale(img, (width, height))
+      if img.get_colorkey() is not None:
+         scaled.set_colorkey(img.get_colorkey())
+      self.images[key] = scaled
+      self.bytes += get_surface_bytes(scaled)
+      while self.bytes > self.max_bytes and len(self.images) > 1:
+         (old_key, old) = self.images.popitem(last=False)
+         self.bytes -= get_surface_bytes(old)
+      return scaled
+
+   def clear(self):
+      self.images = collections.OrderedDict()
+      self.bytes = 0
+
+
+def get_surface_bytes(img):
+   return img.get_width() * img.get_height() * img.get_bytesize()
+
+
+class PlaceholderImage:
+   def __init__(self, key, path):
+      self.key = key
+      self.path = path
@@ -0,0 +1,94 @@
+import json
+import sys
+import time
+
+REPORT_SECONDS = 10
+
+# Times the actions WorldModel.update_on_time dispatches while a profiler is
+# set on the world.  Actions are grouped by kind, the action's own kind
+# (for example 'ore_blob') or, for a plain function, the method that built
+# it, and by the class of the entity that scheduled it.  With no profiler
+# set, update_on_time only pays for one attribute check per call.
+
+class ActionStats:
+   __slots__ = ('count', 'total', 'max', 'tiles')
+
+   def __init__(self):
+      self.count = 0
+      self.total = 0.0
+      self.max = 0.0
+      self.tiles = 0
+
+   def add(self, elapsed, tiles):
+      self.count += 1
+      self.total += elapsed
+      self.max = max(self.max, elapsed)
+      self.tiles += tiles
+
+
+class ActionProfiler:
+   def __init__(self, report_seconds=None, stream=sys.stderr):
+      self.report_seconds = report_seconds
+      self.stream = stream
+      self.totals = {}
+      self.period = {}
+      self.kinds = {}
+      self.last_report = time.time()
+
+   def dispatch(self, handle, ticks):
+      start = time.perf_counter()
+      tiles = handle.item(ticks)
+      self.record(handle, time.perf_counter() - start, len(tiles))
+      return tiles
+
+   def end_update(self):
+      if (self.report_seconds is not None and
+         time.time() - self.last_report >= self.report_seconds):
+         self.stream.write(self.summary(self.period))
+         self.period = {}
+         self.last_report = time.time()
+
+   def get_kind(self, action):
+      kind = getattr(action, 'kind', None)
+      if kind is not None:
+         return kind
+      kind = self.kinds.get(action.__code__)
+      if kind is None:
+         kind = action.__qualname__.split('.<locals>')[0]
+         self.kinds[action.__code__] = kind
+      return kind
+
+   def record(self, handle, elapsed, tiles):
+      key = (self.get_kind(handle.item), handle.owner.__class__.__name__
+         if handle.owner is not None else '-')
+      for stats in (self.totals, self.period):
+         entry = stats.get(key)
+         if entry is None:
+            entry = stats[key] = ActionStats()
+         entry.add(elapsed, tiles)
+
+   def reset(self):
+      self.totals = {}
+      self.period = {}
+      self.last_report = time.time()
+
+   def rows(self, stats=None):
+      stats = self.totals if stats is None else stats
+      return sorted(((kind, owner, entry) for ((kind, owner), entry)
+         in stats.items()), key=lambda row: -row[2].total)
+
+   def summary(self, stats=None):
+      lines = ['%-44s %-14s %8s %10s %9s %9s %8s' % ('kind', 'owner',
+         'count', 'total ms', 'mean us', 'max us', 'tiles')]
+      for (kind, owner, entry) in self.rows(stats):
+         lines.append('%-44s %-14s %8d %10.2f %9.1f %9.1f %8d' % (kind, owner,
+            entry.count, entry.total * 1e3, entry.total / entry.count * 1e6,
+            entry.max * 1e6, entry.tiles))
+      return '\n'.join(lines) + '\n'
+
+   def dump(self, filename):
+      with open(filename, 'w') as file:
+         json.dump([{'kind': kind, 'owner': owner, 'count': entry.count,
+            'total': entry.total, 'max': entry.max, 'tiles': entry.tiles}
+            for (kind, owner, entry) in self.rows()], file, indent=1)
+         file.write('\n')
@@ -2,6 +2,10 @@ import pygame
 
 SAVE_KEY = pygame.K_s
 LOAD_KEY = pygame.K_l
+WARP_KEY = pygame.K_w
+JUMP_KEY = pygame.K_j
+ZOOM_IN_KEY = pygame.K_EQUALS
+ZOOM_OUT_KEY = pygame.K_MINUS
 ENTITY_KEYS = {pygame.K_1 : 'grass',
                pygame.K_2 : 'rocks',
                pygame.K_3 : 'obstacle',
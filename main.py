@@ -1,17 +1,26 @@
+import chunked_world
 import controller
 import entities
 import image_store
+import instrumentation
+import minimap
+import os
 import pygame
 import random
+import recording
 import save_load
 import sys
 import worldmodel
 import worldview
 
 RUN_AFTER_LOAD = True
+PROFILE_ACTIONS = False
+TRACE_FILE = None
+SHOW_MINIMAP = True
 
 IMAGE_LIST_FILE_NAME = 'imagelist'
 WORLD_FILE = 'gaia.sav'
+CHUNKED_WORLD_DIR = 'gaia.chunks'
 
 WORLD_WIDTH_SCALE = 2
 WORLD_HEIGHT_SCALE = 2
@@ -27,12 +36,12 @@ def create_default_background(img):
 
 
 def load_world(world, i_store, filename):
-   with open(filename, 'r') as file:
-      save_load.load_world(world, i_store, file, RUN_AFTER_LOAD)
+   save_load.load_world_file(world, i_store, filename, RUN_AFTER_LOAD)
 
 
 def main():
-   random.seed()
+   seed = recording.new_seed()
+   random.seed(seed)
    pygame.init()
    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
    i_store = image_store.load_images(IMAGE_LIST_FILE_NAME,
@@ -44,15 +53,32 @@ def main():
    default_background = create_default_background(
       image_store.get_images(i_store, image_store.DEFAULT_IMAGE_NAME))
 
-   world = worldmodel.WorldModel(num_rows, num_cols, default_background)
+   if os.path.isdir(CHUNKED_WORLD_DIR):
+      world_file = CHUNKED_WORLD_DIR
+      world = chunked_world.open_world(CHUNKED_WORLD_DIR, i_store,
+         RUN_AFTER_LOAD)
+   else:
+      world_file = WORLD_FILE
+      world = worldmodel.WorldModel(num_rows, num_cols, default_background)
+      load_world(world, i_store, WORLD_FILE)
+
    view = worldview.WorldView(SCREEN_WIDTH // TILE_WIDTH,
       SCREEN_HEIGHT // TILE_HEIGHT, screen, world, TILE_WIDTH, TILE_HEIGHT)
-
-   load_world(world, i_store, WORLD_FILE)
+   if SHOW_MINIMAP:
+      minimap.Minimap(world, view)
 
    view.update_view()
 
-   controller.activity_loop(view, world)
+   if PROFILE_ACTIONS:
+      world.set_profiler(instrumentation.ActionProfiler(
+         instrumentation.REPORT_SECONDS))
+
+   recorder = None
+   if TRACE_FILE:
+      recorder = recording.TraceRecorder(TRACE_FILE, recording.TraceHeader(
+         seed, world_file, num_rows, num_cols, RUN_AFTER_LOAD))
+
+   controller.activity_loop(view, world, recorder)
 
 
 if __name__ == '__main__':
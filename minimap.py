@@ -0,0 +1,160 @@
+import entities
+import pygame
+import point
+import worldmodel
+
+MINIMAP_WIDTH = 160
+MINIMAP_HEIGHT = 120
+MINIMAP_MARGIN = 4
+
+VIEWPORT_COLOR = (255, 255, 255)
+UNKNOWN_COLOR = (255, 0, 255)
+
+ENTITY_COLORS = {
+   entities.MinerNotFull: (255, 255, 0),
+   entities.MinerFull: (255, 160, 0),
+   entities.Blacksmith: (80, 160, 255),
+   entities.Vein: (160, 60, 200),
+   entities.Ore: (200, 0, 0),
+   entities.OreBlob: (0, 255, 0),
+   entities.Quake: (255, 255, 255),
+   entities.Obstacle: (40, 40, 40),
+}
+BACKGROUND_COLORS = {
+   'grass': (40, 120, 40),
+   'rocks': (110, 100, 90),
+}
+
+# An overlay in the top-right corner of a WorldView showing the whole world,
+# one cell per tile.  A world too large for the panel gets one pixel per
+# block of tiles instead, colored by the first entity in the block or else
+# by the block's top-left background.  The map follows world change events
+# and redraws only the cells they touch, once per frame, so the first build
+# is the only pass over every tile.  Clicking it centres the view there.
+#
+# Tiles of a streamed world that are not loaded are shown from the chunk
+# summaries and the world's default background, so the map never loads a
+# chunk itself.  A chunk's cells are redrawn from its real contents when it
+# is loaded.
+
+class Minimap:
+   def __init__(self, world, view, width=MINIMAP_WIDTH,
+      height=MINIMAP_HEIGHT):
+      self.world = world
+      self.view = view
+      self.block = max(1, -(-world.num_cols // width),
+         -(-world.num_rows // height))
+      self.cols = -(-world.num_cols // self.block)
+      self.rows = -(-world.num_rows // self.block)
+      self.cell = max(1, min(width // self.cols, height // self.rows))
+      self.surface = pygame.Surface((self.cols * self.cell,
+         self.rows * self.cell))
+      self.rect = self.surface.get_rect(topright=(
+         view.screen.get_width() - MINIMAP_MARGIN, MINIMAP_MARGIN))
+      self.background_colors = dict(BACKGROUND_COLORS)
+      self.dirty = set()
+      self.rebuild = True
+      self.shown_viewport = None
+      world.subscribe(self.world_changed)
+      view.add_overlay(self)
+
+   def world_changed(self, event, pt, entity, old_pt):
+      if pt is None:
+         self.rebuild = True
+         return
+      if event == worldmodel.CHUNK_LOADED:
+         size = self.world.chunk_size
+         for cy in range(pt.y // self.block,
+            (pt.y + size - 1) // self.block + 1):
+            for cx in range(pt.x // self.block,
+               (pt.x + size - 1) // self.block + 1):
+               self.dirty.add((cx, cy))
+         return
+      if old_pt is not None:
+         self.dirty.add((old_pt.x // self.block, old_pt.y // self.block))
+      self.dirty.add((pt.x // self.block, pt.y // self.block))
+
+   def get_background_color(self, bgnd):
+      color = self.background_colors.get(bgnd.get_name())
+      if color is None:
+         color = get_image_color(bgnd.get_image())
+         self.background_colors[bgnd.get_name()] = color
+      return color
+
+   def get_cell_color(self, cx, cy):
+      world = self.world
+      left = cx * self.block
+      top = cy * self.block
+      for y in range(top, min(top + self.block, world.num_rows)):
+         for x in range(left, min(left + self.block, world.num_cols)):
+            pt = point.Point(x, y)
+            if world.is_loaded(pt):
+               entity = world.get_tile_occupant(pt)
+               if entity is not None:
+                  color = ENTITY_COLORS.get(entity.__class__)
+                  if color is None:
+                     color = get_image_color(entity.get_image())
+                  return color
+            else:
+               ghost = world.get_ghost(pt)
+               if ghost is not None:
+                  return ENTITY_COLORS.get(ghost.cls, UNKNOWN_COLOR)
+      pt = point.Point(left, top)
+      if world.is_loaded(pt):
+         return self.get_background_color(world.get_background(pt))
+      return self.get_background_color(world.default_background)
+
+   def draw_cell(self, cx, cy):
+      self.surface.fill(self.get_cell_color(cx, cy),
+         (cx * self.cell, cy * self.cell, self.cell, self.cell))
+
+   def update(self):
+      if self.rebuild:
+         self.rebuild = False
+         self.dirty = set()
+         for cy in range(0, self.rows):
+            for cx in range(0, self.cols):
+               self.draw_cell(cx, cy)
+         return True
+
+      dirty = self.dirty
+      self.dirty = set()
+      for (cx, cy) in dirty:
+         if 0 <= cx < self.cols and 0 <= cy < self.rows:
+            self.draw_cell(cx, cy)
+      return bool(dirty)
+
+   def get_viewport_rect(self):
+      viewport = self.view.viewport
+      scale = self.cell / self.block
+      return pygame.Rect(self.rect.left + int(viewport.left * scale),
+         self.rect.top + int(viewport.top * scale),
+         max(int(viewport.width * scale), 1),
+         max(int(viewport.height * scale), 1)).clip(self.rect)
+
+   def draw(self, screen, rects=None):
+      changed = self.update()
+      viewport = tuple(self.view.viewport)
+      if (rects is not None and not changed and
+         viewport == self.shown_viewport and self.rect.collidelist(rects) < 0):
+         return None
+      self.shown_viewport = viewport
+      screen.blit(self.surface, self.rect)
+      pygame.draw.rect(screen, VIEWPORT_COLOR, self.get_viewport_rect(), 1)
+      return self.rect
+
+   def to_world(self, pos):
+      return point.Point(
+         min((pos[0] - self.rect.left) // self.cell * self.block +
+            self.block // 2, self.world.num_cols - 1),
+         min((pos[1] - self.rect.top) // self.cell * self.block +
+            self.block // 2, self.world.num_rows - 1))
+
+   def click(self, pos):
+      self.view.center_on(self.to_world(pos))
+
+
+def get_image_color(img):
+   if isinstance(img, pygame.Surface):
+      return pygame.transform.average_color(img)[:3]
+   return UNKNOWN_COLOR
@@ -1,3 +1,5 @@
+import array
+
 # define occupancy value
 EMPTY = 0
 GATHERER = 1
@@ -23,4 +25,168 @@ class Grid:
       return self.cells[point.y][point.x]
 
 
+# Occupancy stored as two flat planes: an entity slot per cell, indexing a
+# table of live entities, and a type code per cell (EMPTY for free cells).
+# Type codes are handed out per entity class as classes are first seen.
+class OccupancyGrid:
+   def __init__(self, width, height):
+      self.width = width
+      self.height = height
+      self.slots = array.array('i', [0]) * (width * height)
+      self.types = bytearray(width * height)
+      self.entities = [None]
+      self.refs = [0]
+      self.free_slots = []
+      self.slot_of = {}
+      self.type_codes = {}
+      self.type_classes = [None]
+
+   def get_cell(self, point):
+      return self.entities[self.slots[point.y * self.width + point.x]]
+
+   def is_occupied(self, point):
+      return self.types[point.y * self.width + point.x] != EMPTY
+
+   def set_cell(self, point, value):
+      idx = point.y * self.width + point.x
+      self.release(self.slots[idx])
+      if value is None:
+         self.slots[idx] = 0
+         self.types[idx] = EMPTY
+      else:
+         self.slots[idx] = self.acquire(value)
+         self.types[idx] = self.type_code(value.__class__)
+
+   def acquire(self, entity):
+      slot = self.slot_of.get(entity)
+      if slot is None:
+         if self.free_slots:
+            slot = self.free_slots.pop()
+            self.entities[slot] = entity
+         else:
+            slot = len(self.entities)
+            self.entities.append(entity)
+            self.refs.append(0)
+         self.slot_of[entity] = slot
+      self.refs[slot] += 1
+      return slot
+
+   def release(self, slot):
+      if slot:
+         self.refs[slot] -= 1
+         if self.refs[slot] == 0:
+            del self.slot_of[self.entities[slot]]
+            self.entities[slot] = None
+            self.free_slots.append(slot)
+
+   def type_code(self, cls):
+      code = self.type_codes.get(cls)
+      if code is None:
+         code = len(self.type_classes)
+         self.type_codes[cls] = code
+         self.type_classes.append(cls)
+      return code
+
+   def type_mask(self, match):
+      table = bytearray(256)
+      for code in range(1, len(self.type_classes)):
+         if match(self.type_classes[code]):
+            table[code] = 1
+      return self.types.translate(table)
+
+   def clear_region(self, left, top, width, height):
+      (left, top, right, bottom) = clip(self, left, top, width, height)
+      if right <= left:
+         return
+      for y in range(top, bottom):
+         for x in range(left, right):
+            self.release(self.slots[y * self.width + x])
+         start = y * self.width
+         self.slots[start + left:start + right] = (
+            array.array('i', [0]) * (right - left))
+         self.types[start + left:start + right] = bytes(right - left)
+
+   def free_cells_in_window(self, left, top, width, height):
+      (left, top, right, bottom) = clip(self, left, top, width, height)
+      cells = []
+      for y in range(top, bottom):
+         start = y * self.width
+         row = self.types[start + left:start + right]
+         cells.extend((left + i, y) for (i, code) in enumerate(row)
+            if code == EMPTY)
+      return cells
+
+   def first_free_in_window(self, left, top, width, height):
+      (left, top, right, bottom) = clip(self, left, top, width, height)
+      for y in range(top, bottom):
+         start = y * self.width
+         i = self.types.find(EMPTY, start + left, start + right)
+         if i >= 0:
+            return (i - start, y)
+      return None
+
+
+# Background stored as a small tile id per cell into a palette of shared
+# Background objects.  Backgrounds with the same name and image list are
+# interchangeable, so they share one palette entry.
+class BackgroundGrid:
+   def __init__(self, width, height, background):
+      self.width = width
+      self.height = height
+      self.palette = []
+      self.palette_ids = {}
+      self.tiles = array.array('H',
+         [self.tile_id(background)]) * (width * height)
+
+   def tile_id(self, background):
+      key = (background.name, id(background.imgs))
+      tile = self.palette_ids.get(key)
+      if tile is None:
+         tile = len(self.palette)
+         self.palette.append(background)
+         self.palette_ids[key] = tile
+      return tile
+
+   def get_cell(self, point):
+      return self.palette[self.tiles[point.y * self.width + point.x]]
+
+   def set_cell(self, point, value):
+      self.tiles[point.y * self.width + point.x] = self.tile_id(value)
+
+   def fill_region(self, left, top, width, height, value):
+      (left, top, right, bottom) = clip(self, left, top, width, height)
+      run = array.array('H', [self.tile_id(value)]) * (right - left)
+      for y in range(top, bottom):
+         start = y * self.width
+         self.tiles[start + left:start + right] = run
+
+   def copy(self):
+      return (list(self.palette), array.array('H', self.tiles))
+
+   def load(self, palette, tiles):
+      if len(tiles) != self.width * self.height:
+         raise ValueError('tiles do not match the grid size')
+      ids = [self.tile_id(value) for value in palette]
+      if ids == list(range(len(ids))):
+         self.tiles = array.array('H', tiles)
+      else:
+         self.tiles = array.array('H', [ids[tile] for tile in tiles])
+
+   def set_row_runs(self, y, runs, palette):
+      ids = [self.tile_id(value) for value in palette]
+      row = array.array('H')
+      for i in range(0, len(runs), 2):
+         row.extend(array.array('H', [ids[runs[i + 1]]]) * runs[i])
+      row = row[:self.width]
+      start = y * self.width
+      self.tiles[start:start + len(row)] = row
+
+   def tile_mask(self, name):
+      ids = set(tile for (tile, bgnd) in enumerate(self.palette)
+         if bgnd.name == name)
+      return bytearray(tile in ids for tile in self.tiles)
+
 
+def clip(grid, left, top, width, height):
+   return (max(left, 0), max(top, 0), min(left + width, grid.width),
+      min(top + height, grid.height))
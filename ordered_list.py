@@ -1,44 +1,66 @@
+import heapq
+
+# Items are kept in a binary heap keyed on (ord, -sequence).  Items with the
+# same ord therefore come out most-recently-inserted first, which is the
+# order the original linear-scan insert produced.  Removal only marks the
+# handle returned by insert; cancelled entries are discarded lazily when
+# they reach the head of the heap.
+
 class OrderedList:
    def __init__(self):
-      self.list = []
+      self.heap = []
+      self.sequence = 0
+      self.live = 0
 
 
-   def insert(self, item, ord):
-      size = len(self.list)
-      idx = 0
-      while (idx < size and self.list[idx].ord < ord):
-         idx += 1
+   def __len__(self):
+      return self.live
 
-      self.list[idx:idx] = [ListItem(item, ord)]
 
+   def insert(self, item, ord, owner=None):
+      self.sequence -= 1
+      handle = ListItem(item, ord, owner)
+      heapq.heappush(self.heap, (ord, self.sequence, handle))
+      self.live += 1
+      return handle
 
-   def remove(self, item):
-      size = len(self.list)
-      idx = 0
-      while (idx < size and self.list[idx].item != item):
-         idx += 1
 
-      if idx < size:
-         self.list[idx:idx+1] = []
+   def remove(self, handle):
+      if handle.pending:
+         handle.pending = False
+         self.live -= 1
 
 
    def head(self):
-      return self.list[0] if self.list else None
+      heap = self.heap
+      while heap and not heap[0][2].pending:
+         heapq.heappop(heap)
+      return heap[0][2] if heap else None
+
+
+   def count_before(self, ord):
+      return sum(1 for (item_ord, sequence, handle) in self.heap
+         if item_ord < ord and handle.pending)
 
 
    def pop(self):
-      if self.list:
-         return self.list.pop(0)
+      handle = self.head()
+      if handle:
+         heapq.heappop(self.heap)
+         handle.pending = False
+         self.live -= 1
+      return handle
 
 
 class ListItem:
-   def __init__(self, item, ord):
+   __slots__ = ('item', 'ord', 'owner', 'pending')
+
+   def __init__(self, item, ord, owner=None):
       self.item = item
       self.ord = ord
+      self.owner = owner
+      self.pending = True
 
 
    def __eq__(a, b):
       return a.item == b.item and a.ord == b.ord
-
-
-
@@ -0,0 +1,376 @@
+import engine
+import entities
+import image_store
+import multiprocessing
+import point
+import random
+import save_load
+import sys
+import time
+import worldmodel
+
+WINDOW = 1000
+HALO_WIDTH = 4
+SEED_STRIDE = 7919
+HANDOFF_SEARCH = 4
+
+GLOBAL_KINDS = ('Ore', 'Vein', 'Blacksmith', 'Obstacle')
+HANDOFF_CLASSES = dict((cls.__name__, cls) for cls in (entities.MinerNotFull,
+   entities.MinerFull, entities.OreBlob, entities.Quake, entities.Ore,
+   entities.Vein, entities.Blacksmith, entities.Obstacle))
+HANDOFF_IMAGES = {
+   'MinerNotFull': 'miner',
+   'MinerFull': 'miner',
+   'OreBlob': 'blob',
+   'Quake': 'quake',
+   'Ore': 'ore',
+   'Vein': 'vein',
+   'Blacksmith': 'blacksmith',
+   'Obstacle': 'obstacle'}
+HANDOFF_SKIP = ('imgs', 'current_img', 'action', 'pending_actions')
+
+# Runs a world split into rectangular regions, one worker process per
+# region.  Each worker loads the whole save, keeps the entities inside its
+# rect, and runs them on its own action queue and random seed.  Workers
+# advance together a window of WINDOW ms at a time; between windows the
+# coordinator routes what crossed a region edge:
+#
+#  - An entity that ends a window outside its region's rect is handed to
+#    the region it is in.  It is scheduled there afresh from the end of the
+#    window, as if it had just been loaded, so a crossing entity loses the
+#    rest of its current period.  If its tile is taken it goes to the
+#    nearest open tile, and is dropped if there is none within
+#    HANDOFF_SEARCH.
+#  - Every region sees a copy of the other regions' ore, veins, blacksmiths
+#    and obstacles, so find_nearest and the distance fields span the map.
+#    Miners, blobs and quakes of other regions are copied only within
+#    HALO_WIDTH tiles of the rect, as blockers.  Copies are as of the end
+#    of the previous window, so a window should be short enough that
+#    nothing outruns the halo.
+#  - Taking a copied ore or vein, or depositing into a copied blacksmith,
+#    is sent to the owning region and applied at the end of the window if
+#    the target is still there.  If it has moved on, for instance ore that
+#    turned into a blob, the remote take still counts.
+#
+# Results depend only on the save, the seed and the region layout.  With a
+# single region nothing crosses an edge and the run matches engine.Engine
+# stepping the same save with random.seed(seed).
+
+class RegionLayout:
+   def __init__(self, num_cols, num_rows, region_cols, region_rows):
+      self.num_cols = num_cols
+      self.num_rows = num_rows
+      self.width = (num_cols + region_cols - 1) // region_cols
+      self.height = (num_rows + region_rows - 1) // region_rows
+      self.cols = (num_cols + self.width - 1) // self.width
+      self.rects = [(left, top, min(self.width, num_cols - left),
+         min(self.height, num_rows - top))
+         for top in range(0, num_rows, self.height)
+         for left in range(0, num_cols, self.width)]
+
+   def owner(self, x, y):
+      return (y // self.height) * self.cols + x // self.width
+
+   def owners_near(self, x, y, distance):
+      left = max(x - distance, 0)
+      right = min(x + distance, self.num_cols - 1)
+      top = max(y - distance, 0)
+      bottom = min(y + distance, self.num_rows - 1)
+      return set(row * self.cols + col
+         for row in range(top // self.height, bottom // self.height + 1)
+         for col in range(left // self.width, right // self.width + 1))
+
+
+class Ghost(entities.Entity):
+   __slots__ = ()
+
+
+class RegionWorldModel(worldmodel.WorldModel):
+   def __init__(self, num_rows, num_cols, background, rect):
+      worldmodel.WorldModel.__init__(self, num_rows, num_cols, background)
+      self.rect = rect
+      self.ghosts = {}
+      self.ghost_keys = {}
+      self.ghost_counts = {}
+      self.reported = set()
+      self.outbox = []
+
+   def owns(self, pt):
+      (left, top, width, height) = self.rect
+      return left <= pt.x < left + width and top <= pt.y < top + height
+
+   def remove_entity_at(self, pt):
+      entity = self.get_tile_occupant(pt)
+      key = self.ghost_keys.get(entity)
+      if key is not None:
+         self.drop_ghost(key)
+         self.outbox.append(('remove', key))
+      else:
+         worldmodel.WorldModel.remove_entity_at(self, pt)
+
+   def add_ghost(self, key, i_store):
+      (kind, name, x, y) = key
+      pt = point.Point(x, y)
+      if self.is_occupied(pt):
+         return
+      imgs = image_store.get_images(i_store, HANDOFF_IMAGES[kind])
+      if kind == 'Ore':
+         ghost = entities.Ore(name, pt, imgs)
+      elif kind == 'Vein':
+         ghost = entities.Vein(name, pt, imgs, 0)
+      elif kind == 'Blacksmith':
+         ghost = entities.Blacksmith(name, pt, imgs, 0, 0)
+         self.ghost_counts[ghost] = 0
+      elif kind == 'Obstacle':
+         ghost = entities.Obstacle(name, pt, imgs)
+      else:
+         ghost = Ghost(name, pt, imgs)
+      self.ghosts[key] = ghost
+      self.ghost_keys[ghost] = key
+      self.add_entity(ghost)
+
+   def drop_ghost(self, key):
+      ghost = self.ghosts.pop(key, None)
+      if ghost is not None:
+         del self.ghost_keys[ghost]
+         self.ghost_counts.pop(ghost, None)
+         worldmodel.WorldModel.remove_entity_at(self, ghost.get_position())
+
+   def update_ghosts(self, added, removed, i_store):
+      for key in removed:
+         self.drop_ghost(key)
+      for key in added:
+         self.add_ghost(key, i_store)
+
+   def own_entities(self):
+      return [entity for entity in self.get_entities()
+         if entity not in self.ghost_keys]
+
+   def collect_outbox(self):
+      for (ghost, count) in list(self.ghost_counts.items()):
+         if ghost.get_resource_count() != count:
+            self.outbox.append(('deposit', self.ghost_keys[ghost],
+               ghost.get_resource_count() - count))
+            self.ghost_counts[ghost] = ghost.get_resource_count()
+
+      for entity in self.own_entities():
+         if not self.owns(entity.get_position()):
+            self.outbox.append(('enter', get_handoff_record(entity)))
+            if isinstance(entity, entities.Actionable):
+               self.clear_pending_actions(entity)
+            worldmodel.WorldModel.remove_entity_at(self,
+               entity.get_position())
+
+      outbox = self.outbox
+      self.outbox = []
+      return outbox
+
+   def apply_inbox(self, inbox, ticks, i_store):
+      for op in inbox:
+         if op[0] == 'enter':
+            self.add_handoff(op[1], ticks, i_store)
+            continue
+
+         (kind, name, x, y) = op[1]
+         entity = self.get_tile_occupant(point.Point(x, y))
+         if (entity is None or entity in self.ghost_keys or
+            entity.__class__.__name__ != kind or entity.get_name() != name):
+            continue
+         if op[0] == 'remove':
+            if isinstance(entity, entities.Actionable):
+               self.clear_pending_actions(entity)
+            self.remove_entity(entity)
+         elif op[0] == 'deposit':
+            entity.set_resource_count(entity.get_resource_count() + op[2])
+
+   def add_handoff(self, record, ticks, i_store):
+      entity = create_from_handoff(record, i_store)
+      pt = entity.get_position()
+      distance = 0
+      while self.is_occupied(pt) and distance < HANDOFF_SEARCH:
+         distance += 1
+         pt = self.find_open_around(entity.get_position(), distance) or pt
+      if self.is_occupied(pt):
+         return
+      entity.set_position(pt)
+      self.add_entity(entity)
+      schedule_handoff(self, entity, ticks, i_store)
+
+   def report(self):
+      state = set(get_ghost_key(entity) for entity in self.own_entities())
+      added = sorted(state - self.reported)
+      removed = sorted(self.reported - state)
+      self.reported = state
+      return (added, removed)
+
+
+class ParallelEngine:
+   def __init__(self, filename, num_rows, num_cols, region_cols=2,
+      region_rows=1, seed=0, window=WINDOW, step=engine.STEP):
+      if window % step != 0:
+         raise ValueError('window must be a whole number of steps')
+      self.layout = RegionLayout(num_cols, num_rows, region_cols, region_rows)
+      self.window = window
+      self.ticks = 0
+      self.connections = []
+      self.workers = []
+      for (i, rect) in enumerate(self.layout.rects):
+         (conn, child_conn) = multiprocessing.Pipe()
+         worker = multiprocessing.Process(target=run_worker,
+            args=(child_conn, filename, num_rows, num_cols, rect,
+            region_seed(seed, i), step))
+         worker.daemon = True
+         worker.start()
+         self.connections.append(conn)
+         self.workers.append(worker)
+
+      self.states = [set() for rect in self.layout.rects]
+      self.inboxes = [[] for rect in self.layout.rects]
+      self.ghosts = [([], []) for rect in self.layout.rects]
+      self.exchange()
+
+   def exchange(self):
+      for (conn, inbox) in zip(self.connections, self.inboxes):
+         conn.send(('apply', inbox))
+      self.inboxes = [[] for rect in self.layout.rects]
+
+      self.ghosts = [([], []) for rect in self.layout.rects]
+      for (source, conn) in enumerate(self.connections):
+         (added, removed) = conn.recv()
+         self.states[source].difference_update(removed)
+         self.states[source].update(added)
+         for key in removed:
+            for region in self.ghost_regions(key, source):
+               self.ghosts[region][1].append(key)
+         for key in added:
+            for region in self.ghost_regions(key, source):
+               self.ghosts[region][0].append(key)
+
+   def ghost_regions(self, key, source):
+      if key[0] in GLOBAL_KINDS:
+         regions = range(0, len(self.layout.rects))
+      else:
+         regions = sorted(self.layout.owners_near(key[2], key[3], HALO_WIDTH))
+      return [region for region in regions if region != source]
+
+   def advance(self, end):
+      for (conn, (added, removed)) in zip(self.connections, self.ghosts):
+         conn.send(('advance', end, added, removed))
+      for conn in self.connections:
+         for op in conn.recv():
+            self.route(op)
+      self.ticks = end
+      self.exchange()
+
+   def route(self, op):
+      if op[0] == 'enter':
+         pt = op[1][1]['position']
+         (x, y) = (pt.x, pt.y)
+      else:
+         (x, y) = op[1][2:4]
+      self.inboxes[self.layout.owner(x, y)].append(op)
+
+   def run(self, end):
+      while self.ticks < end:
+         self.advance(min(self.ticks + self.window, end))
+
+   def get_state(self):
+      return sorted(key for state in self.states for key in state)
+
+   def close(self):
+      for conn in self.connections:
+         conn.send(('stop',))
+      for worker in self.workers:
+         worker.join()
+
+
+def run_worker(conn, filename, num_rows, num_cols, rect, seed, step):
+   random.seed(seed)
+   i_store = image_store.load_placeholder_images(engine.IMAGE_LIST_FILE_NAME)
+   world = RegionWorldModel(num_rows, num_cols,
+      engine.create_default_background(i_store), rect)
+   save_load.load_world_file(world, i_store, filename)
+   for entity in world.get_entities():
+      if not world.owns(entity.get_position()):
+         world.remove_entity(entity)
+   for entity in world.get_entities():
+      save_load.schedule_entity(world, entity, i_store)
+   region_engine = engine.Engine(world)
+
+   while True:
+      message = conn.recv()
+      if message[0] == 'apply':
+         world.apply_inbox(message[1], region_engine.ticks, i_store)
+         conn.send(world.report())
+      elif message[0] == 'advance':
+         world.update_ghosts(message[2], message[3], i_store)
+         region_engine.run_fixed_step(message[1], step)
+         conn.send(world.collect_outbox())
+      else:
+         conn.close()
+         return
+
+
+def region_seed(seed, region):
+   return seed + region * SEED_STRIDE
+
+
+def get_ghost_key(entity):
+   pt = entity.get_position()
+   return (entity.__class__.__name__, entity.get_name(), pt.x, pt.y)
+
+
+def get_handoff_record(entity):
+   slots = [name for cls in entity.__class__.__mro__
+      for name in getattr(cls, '__slots__', ())]
+   return (entity.__class__.__name__, dict((name, getattr(entity, name))
+      for name in slots if name not in HANDOFF_SKIP))
+
+
+def create_from_handoff(record, i_store):
+   (kind, state) = record
+   cls = HANDOFF_CLASSES[kind]
+   entity = cls.__new__(cls)
+   for (name, value) in state.items():
+      setattr(entity, name, value)
+   entity.imgs = image_store.get_images(i_store, HANDOFF_IMAGES[kind])
+   entity.current_img = 0
+   if isinstance(entity, entities.Actionable):
+      entity.pending_actions = {}
+      entity.action = None
+   return entity
+
+
+def schedule_handoff(world, entity, ticks, i_store):
+   if isinstance(entity, entities.Miner):
+      entity.schedule_miner(world, ticks, i_store)
+   elif isinstance(entity, entities.OreBlob):
+      entity.schedule_blob(world, ticks, i_store)
+   elif isinstance(entity, entities.Quake):
+      entity.schedule_quake(world, ticks)
+   elif isinstance(entity, entities.Ore):
+      entity.schedule_ore(world, ticks, i_store)
+   elif isinstance(entity, entities.Vein):
+      entity.schedule_vein(world, ticks, i_store)
+
+
+def main(argv):
+   seconds = int(argv[1]) if len(argv) > 1 else engine.RUN_SECONDS
+   (region_cols, region_rows) = [int(value) for value in
+      (argv[2] if len(argv) > 2 else '2x1').split('x')]
+   filename = argv[3] if len(argv) > 3 else engine.WORLD_FILE
+   num_cols = int(argv[4]) if len(argv) > 4 else engine.NUM_COLS
+   num_rows = int(argv[5]) if len(argv) > 5 else engine.NUM_ROWS
+
+   parallel = ParallelEngine(filename, num_rows, num_cols, region_cols,
+      region_rows)
+   start = time.time()
+   parallel.run(seconds * 1000)
+   elapsed = time.time() - start
+   print('simulated %d s in %.3f s over %d regions, %d entities' %
+      (seconds, elapsed, len(parallel.workers), len(parallel.get_state())))
+   parallel.close()
+
+
+if __name__ == '__main__':
+   main(sys.argv)
@@ -0,0 +1,118 @@
+import collections
+import entities
+import point
+
+UNREACHABLE = -1
+
+# Entities that never move.  Everything else is treated as passable when
+# building a field; movers check the live occupancy as they step.
+STATIC_TYPES = (entities.Obstacle, entities.Blacksmith, entities.Vein)
+
+NEIGHBORS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+
+# Breadth-first distance, in steps, from every tile to the nearest tile
+# holding an entity of target_type.  Static entities other than targets
+# block the search.  The field is built on the first query.  After that,
+# additions of targets and removals of blockers are merged in
+# incrementally, because they can only shorten distances.  Changes that can
+# lengthen distances mark the field for a rebuild on the next query.
+class DistanceField:
+   def __init__(self, world, target_type):
+      self.world = world
+      self.target_type = target_type
+      self.width = world.num_cols
+      self.height = world.num_rows
+      self.dist = None
+
+   def is_target(self, entity):
+      return isinstance(entity, self.target_type)
+
+   def is_blocker(self, entity):
+      return self.is_blocker_class(entity.__class__)
+
+   def is_blocker_class(self, cls):
+      return (issubclass(cls, STATIC_TYPES) and
+         not issubclass(cls, self.target_type))
+
+   def get_distance(self, pt):
+      if self.dist is None:
+         self.rebuild()
+      return self.dist[pt.y * self.width + pt.x]
+
+   def rebuild(self):
+      self.dist = [UNREACHABLE] * (self.width * self.height)
+      sources = []
+      for entity in self.world.entities.of_type(self.target_type):
+         pt = entity.get_position()
+         self.dist[pt.y * self.width + pt.x] = 0
+         sources.append((pt.x, pt.y))
+      self.propagate(collections.deque(sources))
+
+   def propagate(self, queue):
+      dist = self.dist
+      width = self.width
+      height = self.height
+      blocked = self.world.occupancy.type_mask(self.is_blocker_class)
+      while queue:
+         (x, y) = queue.popleft()
+         next_dist = dist[y * width + x] + 1
+         for (dx, dy) in NEIGHBORS:
+            nx = x + dx
+            ny = y + dy
+            if 0 <= nx < width and 0 <= ny < height:
+               idx = ny * width + nx
+               if ((dist[idx] == UNREACHABLE or dist[idx] > next_dist) and
+                  not blocked[idx]):
+                  dist[idx] = next_dist
+                  queue.append((nx, ny))
+
+   def entity_added(self, entity):
+      if self.dist is None:
+         return
+      pt = entity.get_position()
+      idx = pt.y * self.width + pt.x
+      if self.is_target(entity):
+         self.dist[idx] = 0
+         self.propagate(collections.deque([(pt.x, pt.y)]))
+      elif self.is_blocker(entity) and self.dist[idx] > 0:
+         self.dist = None
+
+   def entity_removed(self, entity, pt):
+      if self.dist is None:
+         return
+      if self.is_target(entity):
+         self.dist = None
+      elif self.is_blocker(entity):
+         self.reopen(pt)
+
+   def reopen(self, pt):
+      best = UNREACHABLE
+      for (dx, dy) in NEIGHBORS:
+         nx = pt.x + dx
+         ny = pt.y + dy
+         if 0 <= nx < self.width and 0 <= ny < self.height:
+            d = self.dist[ny * self.width + nx]
+            if d != UNREACHABLE and (best == UNREACHABLE or d < best):
+               best = d
+      idx = pt.y * self.width + pt.x
+      self.dist[idx] = UNREACHABLE
+      if best != UNREACHABLE:
+         self.dist[idx] = best + 1
+         self.propagate(collections.deque([(pt.x, pt.y)]))
+
+   def next_position(self, entity_pt, passable):
+      here = self.get_distance(entity_pt)
+      if here == UNREACHABLE:
+         return None
+
+      best = entity_pt
+      best_dist = here
+      for (dx, dy) in NEIGHBORS:
+         new_pt = point.Point(entity_pt.x + dx, entity_pt.y + dy)
+         if self.world.within_bounds(new_pt):
+            d = self.get_distance(new_pt)
+            if d != UNREACHABLE and d < best_dist and passable(new_pt):
+               best = new_pt
+               best_dist = d
+      return best
@@ -1,4 +1,55 @@
-class Point:
-   def __init__(self, x, y):
-      self.x = x
-      self.y = y
+_rows = []
+
+# Points are immutable, so one instance per coordinate can be shared.
+# Coordinates inside the area passed to reserve are interned on first use;
+# anything outside it gets a fresh instance.
+
+class Point(object):
+   __slots__ = ('x', 'y')
+
+   def __new__(cls, x, y):
+      if 0 <= y < len(_rows):
+         row = _rows[y]
+         if 0 <= x < len(row):
+            pt = row[x]
+            if pt is None:
+               pt = row[x] = create(cls, x, y)
+            return pt
+      return create(cls, x, y)
+
+   def __setattr__(self, name, value):
+      raise AttributeError('Point is immutable')
+
+   def __delattr__(self, name):
+      raise AttributeError('Point is immutable')
+
+   def __eq__(self, other):
+      return (isinstance(other, Point) and
+         self.x == other.x and self.y == other.y)
+
+   def __ne__(self, other):
+      return not self == other
+
+   def __hash__(self):
+      return hash((self.x, self.y))
+
+   def __reduce__(self):
+      return (Point, (self.x, self.y))
+
+   def __repr__(self):
+      return 'Point(%d, %d)' % (self.x, self.y)
+
+
+def create(cls, x, y):
+   pt = object.__new__(cls)
+   object.__setattr__(pt, 'x', x)
+   object.__setattr__(pt, 'y', y)
+   return pt
+
+
+def reserve(num_cols, num_rows):
+   for row in _rows:
+      if len(row) < num_cols:
+         row.extend([None] * (num_cols - len(row)))
+   while len(_rows) < num_rows:
+      _rows.append([None] * num_cols)
@@ -0,0 +1,208 @@
+import builder_controller
+import chunked_world
+import engine
+import image_store
+import instrumentation
+import io
+import os
+import point
+import pygame
+import random
+import save_load
+import sys
+import time
+
+TRACE_MAGIC = b'GTRC'
+TRACE_VERSION = 1
+SEED_BITS = 32
+
+TICK = 0
+VIEWPORT = 1
+EDIT = 2
+LOAD = 3
+
+# A trace holds what a run needs to be repeated exactly: the seed the global
+# random was given, the world it started from, and then, in order, every
+# timer tick with the number of actions update_on_time dispatched for it,
+# every viewport change (the chunked world streams by viewport) and every
+# builder edit or reload.  Replaying runs each tick with that action count
+# instead of a time budget, so the actions run in the same order however
+# slow the replaying machine is.
+#
+# The file is the magic, then varints for the version, seed, rows, columns
+# and whether loaded entities run, then the world path as a save_load
+# string ('' for an empty world).  Each record is a kind byte followed by
+#    TICK      ticks since the previous tick, actions dispatched
+#    VIEWPORT  left, top, width, height
+#    EDIT      x, y, then the builder selection as a string, '' to remove
+#    LOAD      the world file as a string
+# A chunked world directory is changed by the run that saves into it, so
+# replaying one needs a copy taken before the recording started.
+
+class TraceHeader:
+   def __init__(self, seed, world_file, num_rows, num_cols, run):
+      self.seed = seed
+      self.world_file = world_file
+      self.num_rows = num_rows
+      self.num_cols = num_cols
+      self.run = run
+
+
+class TraceRecorder:
+   def __init__(self, filename, header):
+      self.file = open(filename, 'wb')
+      self.ticks = 0
+      self.viewport = None
+      self.file.write(TRACE_MAGIC)
+      for value in (TRACE_VERSION, header.seed, header.num_rows,
+         header.num_cols, int(header.run)):
+         write_varint(self.file, value)
+      save_load.write_string(self.file, header.world_file)
+
+   def record_tick(self, ticks, dispatched, viewport=None):
+      if viewport is not None:
+         rect = (viewport.left, viewport.top, viewport.width, viewport.height)
+         if rect != self.viewport:
+            self.viewport = rect
+            self.file.write(bytes((VIEWPORT,)))
+            for value in rect:
+               write_varint(self.file, value)
+      self.file.write(bytes((TICK,)))
+      write_varint(self.file, ticks - self.ticks)
+      write_varint(self.file, dispatched)
+      self.ticks = ticks
+
+   def record_edit(self, pt, entity_select):
+      self.file.write(bytes((EDIT,)))
+      write_varint(self.file, pt.x)
+      write_varint(self.file, pt.y)
+      save_load.write_string(self.file, entity_select or '')
+
+   def record_load(self, filename):
+      self.file.write(bytes((LOAD,)))
+      save_load.write_string(self.file, filename)
+
+   def close(self):
+      self.file.close()
+
+
+def new_seed():
+   return random.SystemRandom().getrandbits(SEED_BITS)
+
+
+def write_varint(file, value):
+   data = bytearray()
+   while value >= 0x80:
+      data.append((value & 0x7f) | 0x80)
+      value >>= 7
+   data.append(value)
+   file.write(data)
+
+
+def read_varint(file):
+   value = 0
+   shift = 0
+   while True:
+      byte = file.read(1)
+      if not byte:
+         raise EOFError('trace ends inside a record')
+      value |= (byte[0] & 0x7f) << shift
+      if byte[0] < 0x80:
+         return value
+      shift += 7
+
+
+def read_header(file):
+   if file.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+      raise ValueError('not a trace file')
+   version = read_varint(file)
+   if version != TRACE_VERSION:
+      raise ValueError('not a version %d trace' % TRACE_VERSION)
+   (seed, num_rows, num_cols, run) = [read_varint(file) for i in range(4)]
+   return TraceHeader(seed, save_load.read_string(file), num_rows, num_cols,
+      bool(run))
+
+
+def read_records(file):
+   # A run that was killed can leave a partial record at the end; the
+   # records before it are still returned.
+   ticks = 0
+   while True:
+      kind = file.read(1)
+      if not kind:
+         return
+      try:
+         if kind[0] == TICK:
+            ticks += read_varint(file)
+            record = (TICK, ticks, read_varint(file))
+         elif kind[0] == VIEWPORT:
+            record = (VIEWPORT, pygame.Rect(*[read_varint(file)
+               for i in range(4)]))
+         elif kind[0] == EDIT:
+            x = read_varint(file)
+            y = read_varint(file)
+            record = (EDIT, x, y, save_load.read_string(file) or None)
+         elif kind[0] == LOAD:
+            record = (LOAD, save_load.read_string(file))
+         else:
+            raise ValueError('unknown trace record %d' % kind[0])
+      except EOFError:
+         return
+      yield record
+
+
+def create_world(header, i_store):
+   if os.path.isdir(header.world_file):
+      return chunked_world.open_world(header.world_file, i_store, header.run)
+   world = engine.create_world(i_store, header.num_rows, header.num_cols)
+   if header.world_file:
+      engine.load_world(world, i_store, header.world_file, header.run)
+   return world
+
+
+def replay(filename, profiler=None):
+   with open(filename, 'rb') as trace_file:
+      file = io.BytesIO(trace_file.read())
+   header = read_header(file)
+   random.seed(header.seed)
+   i_store = image_store.load_placeholder_images(engine.IMAGE_LIST_FILE_NAME)
+   world = create_world(header, i_store)
+   world.set_profiler(profiler)
+
+   viewport = None
+   ticks = 0
+   for record in read_records(file):
+      if record[0] == TICK:
+         ticks = record[1]
+         world.update_on_time(ticks, record[2])
+         world.update_streaming(viewport)
+      elif record[0] == VIEWPORT:
+         viewport = record[1]
+      elif record[0] == EDIT:
+         builder_controller.edit_tile(world,
+            point.Point(record[1], record[2]), record[3], i_store)
+      elif record[0] == LOAD:
+         save_load.load_world_file(world, i_store, record[1])
+   return (world, ticks)
+
+
+def main(argv):
+   if len(argv) < 2:
+      print('usage: recording.py trace_file [profile_file]')
+      return
+
+   profile_file = argv[2] if len(argv) > 2 else None
+   profiler = instrumentation.ActionProfiler() if profile_file else None
+   start = time.time()
+   (world, ticks) = replay(argv[1], profiler)
+   elapsed = time.time() - start
+
+   print('replayed %d ms in %.3f s, %d entities' %
+      (ticks, elapsed, len(world.get_entities())))
+   if profile_file:
+      sys.stdout.write(profiler.summary())
+      profiler.dump(profile_file)
+
+
+if __name__ == '__main__':
+   main(sys.argv)
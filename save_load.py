@@ -1,7 +1,12 @@
 import actions
+import array
 import entities
 import image_store
+import itertools
+import os
 import point
+import struct
+import sys
 import worldmodel
 
 PROPERTY_KEY = 0
@@ -51,14 +56,57 @@ VEIN_COL = 2
 VEIN_ROW = 3
 VEIN_REACH = 5
 
+BINARY_MAGIC = b'GAIA'
+BINARY_VERSION = 1
+BINARY_EXTENSION = '.bsav'
+BINARY_HEADER = struct.Struct('<4sHII')
+BINARY_COUNT = struct.Struct('<I')
+BINARY_ENTITY = struct.Struct('<BBii')
+BINARY_ENTITY_KEYS = [MINER_KEY, VEIN_KEY, ORE_KEY, SMITH_KEY, OBSTACLE_KEY]
+BINARY_NUM_PROPERTIES = [MINER_NUM_PROPERTIES, VEIN_NUM_PROPERTIES,
+   ORE_NUM_PROPERTIES, SMITH_NUM_PROPERTIES, OBSTACLE_NUM_PROPERTIES]
+BINARY_MAX_RUN = 0xFFFF
+
+
+# Saving works from a WorldSnapshot: the entity records plus a copy of the
+# background tile ids and palette names.  Taking one is cheap, and after
+# that the writers never touch the world, so they can run on another
+# thread.
+
+class WorldSnapshot:
+   def __init__(self, num_cols, num_rows, palette, tiles, records):
+      self.num_cols = num_cols
+      self.num_rows = num_rows
+      self.palette = palette
+      self.tiles = tiles
+      self.records = records
+
+
+def take_snapshot(world):
+   (palette, tiles) = world.copy_background()
+   records = [get_entity_record(entity) for entity in world.get_entities()]
+   return WorldSnapshot(world.num_cols, world.num_rows,
+      [bgnd.get_name() for bgnd in palette], tiles,
+      [record for record in records if record])
+
 
 def save_world(world, file):
-   save_entities(world, file)
-   save_background(world, file)
+   write_snapshot(take_snapshot(world), file)
+
+
+def write_snapshot(snapshot, file):
+   for (key, name, x, y, values) in snapshot.records:
+      file.write(' '.join([key, name, str(x), str(y)] +
+         [str(value) for value in values]) + '\n')
+
+   names = snapshot.palette
+   tiles = snapshot.tiles
+   for row in range(0, snapshot.num_rows):
+      start = row * snapshot.num_cols
+      file.write(''.join('background %s %d %d\n' %
+         (names[tiles[start + col]], col, row)
+         for col in range(0, snapshot.num_cols)))
 
-def save_entities(world, file):
-   for entity in world.get_entities():
-      file.write(get_entity_string(entity) + '\n')
 
 def get_entity_string(self):
    try:
@@ -67,13 +115,6 @@ def get_entity_string(self):
       return 'unknown'
 
 
-def save_background(world, file):
-   for row in range(0, world.num_rows):
-      for col in range(0, world.num_cols):
-         file.write('background ' + world.get_name() +
-            ' ' + str(col) + ' ' + str(row) + '\n')
-
-
 def load_world(world, images, file, run=False):
    for line in file:
       properties = line.split()
@@ -84,6 +125,187 @@ def load_world(world, images, file, run=False):
             add_entity(world, properties, images, run)
 
 
+def load_world_file(world, i_store, filename, run=False):
+   with open(filename, 'rb') as file:
+      binary = file.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+   if binary:
+      with open(filename, 'rb') as file:
+         load_world_binary(world, i_store, file, run)
+   else:
+      with open(filename, 'r') as file:
+         load_world(world, i_store, file, run)
+
+
+def save_world_file(world, filename):
+   write_snapshot_file(take_snapshot(world), filename)
+
+
+def write_snapshot_file(snapshot, filename):
+   # Written beside the target and renamed over it, so an interrupted save
+   # leaves the previous file intact.
+   temp_name = filename + '.tmp'
+   if filename.endswith(BINARY_EXTENSION):
+      file = open(temp_name, 'wb')
+      write = write_snapshot_binary
+   else:
+      file = open(temp_name, 'w')
+      write = write_snapshot
+   with file:
+      write(snapshot, file)
+      file.flush()
+      os.fsync(file.fileno())
+   os.replace(temp_name, filename)
+
+
+# Binary format, all integers little-endian:
+#
+#   header      magic 'GAIA', u16 version, u32 columns, u32 rows
+#   palette     u32 count, then count strings
+#   background  per row: u32 run count, then (u16 length, u16 palette id)
+#               pairs
+#   entities    u32 count, then per entity: u8 kind (an index into
+#               BINARY_ENTITY_KEYS), u8 property count, i32 column,
+#               i32 row, a string name and the i32 properties that follow
+#               the position in the text format
+#
+# Strings are a u32 byte count followed by UTF-8.
+
+def save_world_binary(world, file):
+   write_snapshot_binary(take_snapshot(world), file)
+
+
+def write_snapshot_binary(snapshot, file):
+   file.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION,
+      snapshot.num_cols, snapshot.num_rows))
+
+   palette = []
+   palette_ids = {}
+   for name in snapshot.palette:
+      if name not in palette_ids:
+         palette_ids[name] = len(palette)
+         palette.append(name)
+   ids = [palette_ids[name] for name in snapshot.palette]
+
+   file.write(BINARY_COUNT.pack(len(palette)))
+   for name in palette:
+      write_string(file, name)
+
+   key = None
+   if ids != list(range(len(ids))):
+      key = ids.__getitem__
+   for row in range(0, snapshot.num_rows):
+      start = row * snapshot.num_cols
+      runs = array.array('H')
+      for (tile, run) in itertools.groupby(
+         snapshot.tiles[start:start + snapshot.num_cols], key):
+         count = sum(1 for i in run)
+         while count > 0:
+            runs.extend((min(count, BINARY_MAX_RUN), tile))
+            count -= BINARY_MAX_RUN
+      file.write(BINARY_COUNT.pack(len(runs) // 2))
+      file.write(to_little_endian(runs).tobytes())
+
+   file.write(BINARY_COUNT.pack(len(snapshot.records)))
+   for (key, name, x, y, values) in snapshot.records:
+      file.write(BINARY_ENTITY.pack(BINARY_ENTITY_KEYS.index(key),
+         len(values), x, y))
+      write_string(file, name)
+      file.write(struct.pack('<%di' % len(values), *values))
+
+
+def get_entity_record(entity):
+   # Names may contain spaces, so the properties are taken from the end.
+   properties = get_entity_string(entity).split()
+   if properties[PROPERTY_KEY] not in BINARY_ENTITY_KEYS:
+      return None
+   kind = BINARY_ENTITY_KEYS.index(properties[PROPERTY_KEY])
+   num_values = BINARY_NUM_PROPERTIES[kind] - 4
+   values = properties[len(properties) - num_values:]
+   return (properties[PROPERTY_KEY], entity.get_name(),
+      entity.get_position().x, entity.get_position().y,
+      [int(value) for value in values])
+
+
+def load_world_binary(world, i_store, file, run=False):
+   (num_cols, num_rows, names) = read_binary_header(file)
+   palette = [entities.Background(name, image_store.get_images(i_store, name))
+      for name in names]
+
+   for row in range(0, num_rows):
+      world.set_background_runs(row, read_binary_runs(file), palette)
+
+   for record in read_binary_records(file):
+      add_entity(world, get_record_properties(record), i_store, run)
+
+
+def read_snapshot_binary(file):
+   (num_cols, num_rows, names) = read_binary_header(file)
+   tiles = array.array('H')
+   for row in range(0, num_rows):
+      runs = read_binary_runs(file)
+      for i in range(0, len(runs), 2):
+         tiles.extend(array.array('H', [runs[i + 1]]) * runs[i])
+   if len(tiles) != num_cols * num_rows:
+      raise ValueError('background rows do not match the world size')
+   return WorldSnapshot(num_cols, num_rows, names, tiles,
+      read_binary_records(file))
+
+
+def read_binary_header(file):
+   (magic, version, num_cols, num_rows) = read_struct(file, BINARY_HEADER)
+   if magic != BINARY_MAGIC or version != BINARY_VERSION:
+      raise ValueError('not a version %d world file' % BINARY_VERSION)
+
+   (count,) = read_struct(file, BINARY_COUNT)
+   names = [read_string(file) for i in range(0, count)]
+   return (num_cols, num_rows, names)
+
+
+def read_binary_runs(file):
+   (count,) = read_struct(file, BINARY_COUNT)
+   runs = array.array('H')
+   runs.frombytes(file.read(4 * count))
+   return to_little_endian(runs)
+
+
+def read_binary_records(file):
+   (count,) = read_struct(file, BINARY_COUNT)
+   records = []
+   for i in range(0, count):
+      (kind, num_values, x, y) = read_struct(file, BINARY_ENTITY)
+      name = read_string(file)
+      values = struct.unpack('<%di' % num_values, file.read(4 * num_values))
+      records.append((BINARY_ENTITY_KEYS[kind], name, x, y, list(values)))
+   return records
+
+
+def get_record_properties(record):
+   (key, name, x, y, values) = record
+   return [key, name, str(x), str(y)] + [str(value) for value in values]
+
+
+def to_little_endian(values):
+   if sys.byteorder != 'little':
+      values = array.array(values.typecode, values)
+      values.byteswap()
+   return values
+
+
+def read_struct(file, layout):
+   return layout.unpack(file.read(layout.size))
+
+
+def write_string(file, value):
+   data = value.encode('utf-8')
+   file.write(BINARY_COUNT.pack(len(data)))
+   file.write(data)
+
+
+def read_string(file):
+   (count,) = read_struct(file, BINARY_COUNT)
+   return file.read(count).decode('utf-8')
+
+
 def add_background(world, properties, i_store):
    if len(properties) >= BGND_NUM_PROPERTIES:
       pt = point.Point(int(properties[BGND_COL]), int(properties[BGND_ROW]))
@@ -92,12 +314,12 @@ def add_background(world, properties, i_store):
          entities.Background(name, image_store.get_images(i_store, name)))
 
 
-def add_entity(world, properties, i_store, run):
+def add_entity(world, properties, i_store, run, ticks=0):
    new_entity = create_from_properties(properties, i_store)
    if new_entity:
       world.add_entity(new_entity)
       if run:
-         schedule_entity(world, new_entity, i_store)
+         schedule_entity(world, new_entity, i_store, ticks)
 
 
 def create_from_properties(properties, i_store):
@@ -173,11 +395,11 @@ def create_obstacle(properties, i_store):
       return None
 
 
-def schedule_entity(world, entity, i_store):
+def schedule_entity(world, entity, i_store, ticks=0):
    if isinstance(entity, entities.MinerNotFull):
-      entity.schedule_miner(world, 0, i_store)
+      entity.schedule_miner(world, ticks, i_store)
    elif isinstance(entity, entities.Vein):
-      entity.schedule_vein(world, 0, i_store)
+      entity.schedule_vein(world, ticks, i_store)
    elif isinstance(entity, entities.Ore):
-      entity.schedule_ore(world, 0, i_store)
+      entity.schedule_ore(world, ticks, i_store)
 
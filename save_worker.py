@@ -0,0 +1,46 @@
+import save_load
+import sys
+import threading
+
+# Writes world snapshots on a background thread.  Only the newest pending
+# snapshot for each file is kept, since an older one would be overwritten
+# straight away.
+
+class SaveWorker:
+   def __init__(self):
+      self.pending = {}
+      self.condition = threading.Condition()
+      self.busy = False
+      self.thread = threading.Thread(target=self.run)
+      self.thread.daemon = True
+      self.thread.start()
+
+   def submit(self, snapshot, filename):
+      with self.condition:
+         self.pending[filename] = snapshot
+         self.condition.notify_all()
+
+   def wait(self):
+      with self.condition:
+         while self.pending or self.busy:
+            self.condition.wait()
+
+   def run(self):
+      while True:
+         with self.condition:
+            while not self.pending:
+               self.condition.wait()
+            filename = next(iter(self.pending))
+            snapshot = self.pending.pop(filename)
+            self.busy = True
+
+         # Any failure is reported and the worker carries on, so that wait
+         # never blocks on a save that died with the thread.
+         try:
+            save_load.write_snapshot_file(snapshot, filename)
+         except Exception as e:
+            sys.stderr.write('could not save %s: %s\n' % (filename, e))
+         finally:
+            with self.condition:
+               self.busy = False
+               self.condition.notify_all()
@@ -0,0 +1,112 @@
+CELL_SIZE = 8
+LINEAR_SCAN_LIMIT = 32
+
+# Entities are bucketed by class and then by square cell.  Each entry keeps
+# the sequence number the world assigned when the entity was added, so that
+# ties on distance resolve to the earliest added entity, as a scan over
+# WorldModel.entities would.
+
+class SpatialIndex:
+   def __init__(self, num_cols, num_rows, cell_size=CELL_SIZE):
+      self.cell_size = cell_size
+      self.cell_cols = (num_cols + cell_size - 1) // cell_size
+      self.cell_rows = (num_rows + cell_size - 1) // cell_size
+      self.buckets = {}
+      self.counts = {}
+
+   def cell_key(self, pt):
+      return (pt.y // self.cell_size) * self.cell_cols + pt.x // self.cell_size
+
+   def add(self, entity, pt, seq, cls=None):
+      cls = cls or entity.__class__
+      cells = self.buckets.get(cls)
+      if cells is None:
+         cells = self.buckets[cls] = {}
+         self.counts[cls] = 0
+      key = self.cell_key(pt)
+      cell = cells.get(key)
+      if cell is None:
+         cell = cells[key] = {}
+      cell[entity] = seq
+      self.counts[cls] += 1
+
+   def remove(self, entity, pt, cls=None):
+      cls = cls or entity.__class__
+      cells = self.buckets.get(cls)
+      if cells is None:
+         return None
+      key = self.cell_key(pt)
+      cell = cells.get(key)
+      if cell is None or entity not in cell:
+         return None
+      seq = cell.pop(entity)
+      if not cell:
+         del cells[key]
+      self.counts[cls] -= 1
+      return seq
+
+   def move(self, entity, old_pt, new_pt, cls=None):
+      if self.cell_key(old_pt) != self.cell_key(new_pt):
+         seq = self.remove(entity, old_pt, cls)
+         if seq is not None:
+            self.add(entity, new_pt, seq, cls)
+
+   def matching(self, type):
+      return [cls for cls in self.buckets
+         if issubclass(cls, type) and self.counts[cls] > 0]
+
+   def nearest(self, pt, type):
+      classes = self.matching(type)
+      if not classes:
+         return None
+
+      if sum(self.counts[cls] for cls in classes) <= LINEAR_SCAN_LIMIT:
+         best = None
+         for cls in classes:
+            for cell in self.buckets[cls].values():
+               best = self.closer(pt, cell, best)
+         return best[2] if best else None
+
+      size = self.cell_size
+      cx = pt.x // size
+      cy = pt.y // size
+      max_ring = max(cx, self.cell_cols - 1 - cx, cy, self.cell_rows - 1 - cy)
+      best = None
+      for ring in range(0, max_ring + 1):
+         if best and ring > 0 and ((ring - 1) * size + 1) ** 2 > best[0]:
+            break
+         for key in self.ring_keys(cx, cy, ring):
+            for cls in classes:
+               cell = self.buckets[cls].get(key)
+               if cell:
+                  best = self.closer(pt, cell, best)
+
+      return best[2] if best else None
+
+   def closer(self, pt, cell, best):
+      for entity, seq in cell.items():
+         e_pt = entity.get_position()
+         dist = (pt.x - e_pt.x)**2 + (pt.y - e_pt.y)**2
+         if (best is None or dist < best[0] or
+            (dist == best[0] and seq < best[1])):
+            best = (dist, seq, entity)
+      return best
+
+   def ring_keys(self, cx, cy, ring):
+      cols = self.cell_cols
+      rows = self.cell_rows
+      if ring == 0:
+         return [cy * cols + cx]
+
+      keys = []
+      left = max(cx - ring, 0)
+      right = min(cx + ring, cols - 1)
+      for y in (cy - ring, cy + ring):
+         if 0 <= y < rows:
+            keys.extend(range(y * cols + left, y * cols + right + 1))
+      top = max(cy - ring + 1, 0)
+      bottom = min(cy + ring - 1, rows - 1)
+      for x in (cx - ring, cx + ring):
+         if 0 <= x < cols:
+            keys.extend(y * cols + x for y in range(top, bottom + 1))
+      return keys
@@ -0,0 +1,199 @@
+import builder_controller
+import engine
+import entities
+import image_store
+import itertools
+import multiprocessing
+import random
+import save_load
+import sys
+import time
+import worldmodel
+
+RUN_SECONDS = 120
+SAMPLE_SECONDS = 30
+SEED = 102
+
+# Each sweep parameter names the module constants it sets.  The builder's
+# MINER/VEIN/ORE rate ranges only apply to entities it places, so a run
+# also redraws the rates of the loaded miners, veins and ore from them.
+PARAMETERS = [
+   ('MINER_RATE_MIN', [(builder_controller, 'MINER_RATE_MIN')]),
+   ('MINER_RATE_MAX', [(builder_controller, 'MINER_RATE_MAX')]),
+   ('VEIN_RATE_MIN', [(builder_controller, 'VEIN_RATE_MIN'),
+      (worldmodel, 'VEIN_RATE_MIN')]),
+   ('VEIN_RATE_MAX', [(builder_controller, 'VEIN_RATE_MAX'),
+      (worldmodel, 'VEIN_RATE_MAX')]),
+   ('ORE_RATE_MIN', [(builder_controller, 'ORE_RATE_MIN')]),
+   ('ORE_RATE_MAX', [(builder_controller, 'ORE_RATE_MAX')]),
+   ('ORE_CORRUPT_MIN', [(worldmodel, 'ORE_CORRUPT_MIN')]),
+   ('ORE_CORRUPT_MAX', [(worldmodel, 'ORE_CORRUPT_MAX')]),
+   ('BLOB_RATE_SCALE', [(entities, 'BLOB_RATE_SCALE'),
+      (worldmodel, 'BLOB_RATE_SCALE')]),
+]
+PARAMETER_NAMES = [name for (name, targets) in PARAMETERS]
+
+RANGES = [
+   ('MINER_RATE_MIN', 'MINER_RATE_MAX'),
+   ('VEIN_RATE_MIN', 'VEIN_RATE_MAX'),
+   ('ORE_RATE_MIN', 'ORE_RATE_MAX'),
+   ('ORE_CORRUPT_MIN', 'ORE_CORRUPT_MAX'),
+]
+
+
+def get_defaults():
+   return dict((name, getattr(targets[0][0], targets[0][1]))
+      for (name, targets) in PARAMETERS)
+
+
+def set_parameters(config):
+   for (name, targets) in PARAMETERS:
+      for (module, attr) in targets:
+         setattr(module, attr, config[name])
+
+
+def is_valid(config):
+   return all(config[low] <= config[high] for (low, high) in RANGES)
+
+
+def grid_configs(choices):
+   names = sorted(choices, key=PARAMETER_NAMES.index)
+   configs = []
+   for values in itertools.product(*[choices[name] for name in names]):
+      config = get_defaults()
+      config.update(zip(names, values))
+      configs.append(config)
+   return configs
+
+
+def sample_configs(choices, count, rng):
+   names = sorted(choices, key=PARAMETER_NAMES.index)
+   configs = []
+   for i in range(0, count):
+      config = get_defaults()
+      for name in names:
+         choice = choices[name]
+         if isinstance(choice, tuple):
+            config[name] = rng.randint(choice[0], choice[1])
+         else:
+            config[name] = rng.choice(choice)
+      configs.append(config)
+   return configs
+
+
+def rerate_entities(world):
+   for entity in world.get_entities():
+      if isinstance(entity, entities.MinerNotFull):
+         entity.rate = random.randint(builder_controller.MINER_RATE_MIN,
+            builder_controller.MINER_RATE_MAX)
+      elif isinstance(entity, entities.Vein):
+         entity.rate = random.randint(builder_controller.VEIN_RATE_MIN,
+            builder_controller.VEIN_RATE_MAX)
+      elif isinstance(entity, entities.Ore):
+         entity.rate = random.randint(builder_controller.ORE_RATE_MIN,
+            builder_controller.ORE_RATE_MAX)
+
+
+def run_config(job):
+   (index, config, filename, num_rows, num_cols, seconds, seed) = job
+   defaults = get_defaults()
+   set_parameters(config)
+   try:
+      random.seed(seed)
+      i_store = image_store.load_placeholder_images(
+         engine.IMAGE_LIST_FILE_NAME)
+      world = engine.create_world(i_store, num_rows, num_cols)
+      engine.load_world(world, i_store, filename, False)
+      rerate_entities(world)
+      for entity in world.get_entities():
+         save_load.schedule_entity(world, entity, i_store)
+
+      sim = engine.Engine(world)
+      blobs = []
+      start = time.time()
+      for end in range(SAMPLE_SECONDS, seconds + 1, SAMPLE_SECONDS):
+         sim.run_next_due(end * 1000)
+         blobs.append(len(world.entities.of_class(entities.OreBlob)))
+      sim.run_next_due(seconds * 1000)
+      elapsed = time.time() - start
+
+      delivered = sum(smith.get_resource_count()
+         for smith in world.entities.of_class(entities.Blacksmith))
+      return (index, seed, config, delivered, blobs,
+         len(world.get_entities()), elapsed)
+   finally:
+      set_parameters(defaults)
+
+
+def run_sweep(filename, configs, seconds=RUN_SECONDS, seed=SEED,
+   processes=None, num_rows=engine.NUM_ROWS, num_cols=engine.NUM_COLS):
+   jobs = [(i, config, filename, num_rows, num_cols, seconds, seed + i)
+      for (i, config) in enumerate(configs)]
+   pool = multiprocessing.Pool(processes)
+   try:
+      return list(pool.imap(run_config, jobs))
+   finally:
+      pool.close()
+      pool.join()
+
+
+def write_table(results, seconds, file):
+   samples = ['blobs_%ds' % end
+      for end in range(SAMPLE_SECONDS, seconds + 1, SAMPLE_SECONDS)]
+   file.write('\t'.join(['run', 'seed'] + PARAMETER_NAMES +
+      ['ore_delivered'] + samples +
+      ['blobs_max', 'entities', 'wall_time']) + '\n')
+   for (index, seed, config, delivered, blobs, count, elapsed) in results:
+      file.write('\t'.join([str(index), str(seed)] +
+         [str(config[name]) for name in PARAMETER_NAMES] +
+         [str(delivered)] + [str(n) for n in blobs] +
+         [str(max(blobs) if blobs else 0), str(count), '%.3f' % elapsed]) +
+         '\n')
+
+
+def parse_choice(spec):
+   if ':' in spec:
+      (low, high) = spec.split(':')
+      return (int(low), int(high))
+   return [int(value) for value in spec.split(',')]
+
+
+def main(argv):
+   if len(argv) < 4:
+      print('usage: sweep.py base_file seconds output [samples=N] [seed=S] '
+         '[processes=P] [cols=C rows=R] NAME=a,b,c|NAME=low:high ...')
+      return
+
+   (filename, seconds, output) = (argv[1], int(argv[2]), argv[3])
+   options = {'samples': 0, 'seed': SEED, 'processes': 0,
+      'cols': engine.NUM_COLS, 'rows': engine.NUM_ROWS}
+   choices = {}
+   for arg in argv[4:]:
+      (name, spec) = arg.split('=', 1)
+      if name in options:
+         options[name] = int(spec)
+      elif name in PARAMETER_NAMES:
+         choices[name] = parse_choice(spec)
+      else:
+         raise ValueError('unknown parameter %s' % name)
+
+   if options['samples']:
+      configs = sample_configs(choices, options['samples'],
+         random.Random(options['seed']))
+   elif any(isinstance(choice, tuple) for choice in choices.values()):
+      raise ValueError('low:high ranges need samples=N')
+   else:
+      configs = grid_configs(choices)
+   valid = [config for config in configs if is_valid(config)]
+   if len(valid) < len(configs):
+      sys.stderr.write('skipping %d configurations with min > max\n' %
+         (len(configs) - len(valid)))
+
+   results = run_sweep(filename, valid, seconds, options['seed'],
+      options['processes'] or None, options['rows'], options['cols'])
+   with open(output, 'w') as file:
+      write_table(results, seconds, file)
+
+
+if __name__ == '__main__':
+   main(sys.argv)
@@ -0,0 +1,68 @@
+import engine
+import time
+
+PROGRESS_SECONDS = 0.5
+
+# The simulation clock the controller hands to update_on_time.  At speed 1
+# it follows the wall clock; at speed N it runs N times faster, and jump
+# moves it straight to a later tick.  Changing either rebases the clock at
+# the current wall time so the simulated time never goes backwards.
+
+class SimulationClock:
+   def __init__(self, wall, ticks=None, speed=1):
+      self.wall = wall
+      self.ticks = wall if ticks is None else ticks
+      self.speed = speed
+
+   def get_ticks(self, wall):
+      return self.ticks + (wall - self.wall) * self.speed
+
+   def set_speed(self, speed, wall, ticks=None):
+      self.ticks = self.get_ticks(wall) if ticks is None else ticks
+      self.wall = wall
+      self.speed = speed
+
+   def jump(self, ticks, wall):
+      self.set_speed(self.speed, wall, max(ticks, self.get_ticks(wall)))
+
+
+def fast_forward(world, end, progress=None, recorder=None, rect=None,
+   time_budget=None):
+   # Runs every action due before end straight from the head of the queue,
+   # through engine.run_due_actions.  Every PROGRESS_SECONDS the world
+   # streams and progress is called with (ticks, end, actions dispatched,
+   # seconds elapsed), and a true result cancels the run.  A run cancelled
+   # or out of its time_budget in seconds stops at the last due time it
+   # reached, so world.ticks is left short of end.
+   #
+   # A recorded run streams after every tick instead, as replay does, since
+   # when chunks are dropped and reloaded decides which of two equally near
+   # entities find_nearest returns.
+   start = time.perf_counter()
+   last_report = start
+   dispatched = 0
+   for (ticks, tiles) in engine.run_due_actions(world, world.ticks, end):
+      dispatched += world.dispatched
+      streamed = recorder is not None
+      if streamed:
+         recorder.record_tick(ticks, world.dispatched, rect)
+         world.update_streaming(rect)
+      now = time.perf_counter()
+      if time_budget is not None and now - start >= time_budget:
+         if not streamed:
+            world.update_streaming(rect)
+         return dispatched
+      if now - last_report >= PROGRESS_SECONDS:
+         if not streamed:
+            world.update_streaming(rect)
+         if progress is not None and progress(ticks, end, dispatched,
+            now - start):
+            return dispatched
+         last_report = now
+
+   ticks = max(world.ticks, end)
+   world.update_on_time(ticks)
+   if recorder is not None:
+      recorder.record_tick(ticks, world.dispatched, rect)
+   world.update_streaming(rect)
+   return dispatched
@@ -1,12 +1,15 @@
 import actions
 import entities
+import entity_registry
 import image_store
 import occ_grid
 import ordered_list
 import math
+import pathfinding
 import point
-import pygame
 import random
+import spatial_index
+import time
 
 BLOB_RATE_SCALE = 4
 BLOB_ANIMATION_RATE_SCALE = 50
@@ -24,15 +27,43 @@ VEIN_SPAWN_DELAY = 500
 VEIN_RATE_MIN = 8000
 VEIN_RATE_MAX = 17000
 
+# Change events published to subscribers as callback(event, pt, entity,
+# old_pt).  old_pt is only set for ENTITY_MOVED, and a BACKGROUND_CHANGED
+# with no pt means a whole row or region was replaced at once.  A streamed
+# world publishes CHUNK_LOADED with the chunk's top-left tile once a chunk
+# has been read in.
+ENTITY_ADDED = 'added'
+ENTITY_REMOVED = 'removed'
+ENTITY_MOVED = 'moved'
+BACKGROUND_CHANGED = 'background'
+IMAGE_CHANGED = 'image'
+CHUNK_LOADED = 'chunk'
+
 
 class WorldModel:
    def __init__(self, num_rows, num_cols, background):
-      self.background = occ_grid.Grid(num_cols, num_rows, background)
       self.num_rows = num_rows
       self.num_cols = num_cols
-      self.occupancy = occ_grid.Grid(num_cols, num_rows, None)
-      self.entities = []
+      self.create_grids(background)
+      self.entities = entity_registry.EntityRegistry()
+      self.index = spatial_index.SpatialIndex(num_cols, num_rows)
+      self.distance_fields = {
+         entities.Blacksmith: pathfinding.DistanceField(self,
+            entities.Blacksmith),
+         entities.Vein: pathfinding.DistanceField(self, entities.Vein)}
       self.action_queue = ordered_list.OrderedList()
+      self.profiler = None
+      self.ticks = 0
+      self.backlog = 0
+      self.lag = 0
+      self.dispatched = 0
+      self.subscribers = []
+
+   def create_grids(self, background):
+      point.reserve(self.num_cols, self.num_rows)
+      self.background = occ_grid.BackgroundGrid(self.num_cols, self.num_rows,
+         background)
+      self.occupancy = occ_grid.OccupancyGrid(self.num_cols, self.num_rows)
 
 
    def sign(self, x):
@@ -56,21 +87,26 @@ class WorldModel:
    
    def is_occupied(self, pt):
       return (self.within_bounds(pt) and
-              self.occupancy.get_cell(pt) != None)
+              self.occupancy.is_occupied(pt))
 
    def find_nearest(self, pt, type):
-      oftype = [(e, distance_sq(pt, e.get_position()))
-         for e in self.entities if isinstance(e, type)]
-      return nearest_entity(oftype)
+      return self.index.nearest(pt, type)
+
+   def is_loaded(self, pt):
+      # Whether pt can be read without loading anything; see
+      # chunked_world.ChunkedWorldModel.
+      return True
 
    def add_entity(self, entity):
       pt = entity.get_position()
       if self.within_bounds(pt):
          old_entity = self.occupancy.get_cell(pt)
-         if old_entity != None:
-            old_entity.clear_pending_actions()
+         if isinstance(old_entity, entities.Actionable):
+            self.clear_pending_actions(old_entity)
          self.occupancy.set_cell(pt, entity)
-         self.entities.append(entity)
+         self.register_entity(entity, pt)
+         if self.subscribers:
+            self.publish(ENTITY_ADDED, pt, entity)
 
    def move_entity(self, entity, pt):
       tiles = []
@@ -81,6 +117,9 @@ class WorldModel:
          self.occupancy.set_cell(pt, entity)
          tiles.append(pt)
          entity.set_position(pt)
+         self.index.move(entity, old_pt, pt)
+         if self.subscribers:
+            self.publish(ENTITY_MOVED, pt, entity, old_pt)
       return tiles
 
    def remove_entity(self, entity):
@@ -91,26 +130,127 @@ class WorldModel:
          self.occupancy.get_cell(pt) != None):
          entity = self.occupancy.get_cell(pt)
          entity.set_position(point.Point(-1, -1))
-         self.entities.remove(entity)
          self.occupancy.set_cell(pt, None)
+         self.unregister_entity(entity, pt)
+         if self.subscribers:
+            self.publish(ENTITY_REMOVED, pt, entity)
+
+   def replace_entity(self, old_entity, new_entity):
+      # Swaps the occupant of a tile in place, as when a miner fills up,
+      # and reports it as one IMAGE_CHANGED rather than a removal and an
+      # add.  The new entity takes the old one's position.  Returns False,
+      # changing nothing, if old_entity is not the occupant of its tile.
+      pt = old_entity.get_position()
+      if (not self.within_bounds(pt) or
+         self.occupancy.get_cell(pt) is not old_entity):
+         return False
+      if isinstance(old_entity, entities.Actionable):
+         self.clear_pending_actions(old_entity)
+      old_entity.set_position(point.Point(-1, -1))
+      new_entity.set_position(pt)
+      self.occupancy.set_cell(pt, new_entity)
+      self.unregister_entity(old_entity, pt)
+      self.register_entity(new_entity, pt)
+      if self.subscribers:
+         self.publish(IMAGE_CHANGED, pt, new_entity)
+      return True
+
+   # The bookkeeping every placed entity has besides its occupancy cell:
+   # the registry, the spatial index and the distance fields.
+   def register_entity(self, entity, pt):
+      self.index.add(entity, pt, self.entities.add(entity))
+      if isinstance(entity, pathfinding.STATIC_TYPES):
+         for field in self.distance_fields.values():
+            field.entity_added(entity)
+
+   def unregister_entity(self, entity, pt):
+      self.entities.remove(entity)
+      self.index.remove(entity, pt)
+      if isinstance(entity, pathfinding.STATIC_TYPES):
+         for field in self.distance_fields.values():
+            field.entity_removed(entity, pt)
+
+   def subscribe(self, callback):
+      self.subscribers.append(callback)
+
+   def unsubscribe(self, callback):
+      self.subscribers.remove(callback)
+
+   def publish(self, event, pt, entity=None, old_pt=None):
+      for callback in self.subscribers:
+         callback(event, pt, entity, old_pt)
+
+   def schedule_action(self, action, time, owner=None):
+      return self.action_queue.insert(action, time, owner)
+
+   def unschedule_action(self, handle):
+      self.action_queue.remove(handle)
+
+   def next_action_time(self):
+      next = self.action_queue.head()
+      return next.ord if next else None
 
-   def schedule_action(self, action, time):
-      self.action_queue.insert(action, time)
-
-   def unschedule_action(self, action):
-      self.action_queue.remove(action)
+   def update_on_time(self, ticks, max_actions=None, time_budget=None):
+      self.ticks = ticks
+      if (self.profiler is not None or max_actions is not None or
+         time_budget is not None):
+         return self.update_on_time_limited(ticks, max_actions, time_budget)
 
-   def update_on_time(self, ticks):
       tiles = []
+      count = 0
 
       next = self.action_queue.head()
       while next and next.ord < ticks:
          self.action_queue.pop()
          tiles.extend(next.item(ticks))  # invoke action function
+         count += 1
+         next = self.action_queue.head()
+
+      self.dispatched = count
+      self.backlog = 0
+      self.lag = 0
+      return tiles
+
+   def update_on_time_limited(self, ticks, max_actions, time_budget):
+      # Stops once max_actions have run or time_budget seconds have passed,
+      # always running at least one.  Due actions left over stay at the
+      # head of the queue and run first on the next call.
+      tiles = []
+      profiler = self.profiler
+      count = 0
+      if time_budget is not None:
+         deadline = time.perf_counter() + time_budget
+
+      next = self.action_queue.head()
+      while next and next.ord < ticks:
+         if count > 0 and ((max_actions is not None and count >= max_actions)
+            or (time_budget is not None and time.perf_counter() >= deadline)):
+            break
+         self.action_queue.pop()
+         if profiler is not None:
+            tiles.extend(profiler.dispatch(next, ticks))
+         else:
+            tiles.extend(next.item(ticks))
+         count += 1
          next = self.action_queue.head()
 
+      self.dispatched = count
+      if next and next.ord < ticks:
+         self.backlog = self.action_queue.count_before(ticks)
+         self.lag = ticks - next.ord
+      else:
+         self.backlog = 0
+         self.lag = 0
+      if profiler is not None:
+         profiler.end_update()
       return tiles
 
+   def set_profiler(self, profiler):
+      self.profiler = profiler
+
+   def update_streaming(self, rect=None):
+      pass
+
    def get_background_image(self, pt):
       if self.within_bounds(pt):
          return self.get_image(pt)
@@ -122,6 +262,27 @@ class WorldModel:
    def set_background(self, pt, bgnd):
       if self.within_bounds(pt):
          self.background.set_cell(pt, bgnd)
+         if self.subscribers:
+            self.publish(BACKGROUND_CHANGED, pt)
+
+   def fill_background(self, left, top, width, height, bgnd):
+      self.background.fill_region(left, top, width, height, bgnd)
+      if self.subscribers:
+         self.publish(BACKGROUND_CHANGED, None)
+
+   def set_background_runs(self, row, runs, palette):
+      if 0 <= row < self.num_rows:
+         self.background.set_row_runs(row, runs, palette)
+         if self.subscribers:
+            self.publish(BACKGROUND_CHANGED, None)
+
+   def copy_background(self):
+      return self.background.copy()
+
+   def get_entity_image(self, entity):
+      if isinstance(entity, entities.Animated):
+         return entity.get_image_at(self.ticks)
+      return entity.get_image()
 
    def get_tile_occupant(self, pt):
       if self.within_bounds(pt):
@@ -160,14 +321,32 @@ class WorldModel:
 
       return new_pt  
 
-   def find_open_around(self, pt, distance):
-      for dy in range(-distance, distance + 1):
-         for dx in range(-distance, distance + 1):
-            new_pt = point.Point(pt.x + dx, pt.y + dy)
+   def is_open(self, pt):
+      return not self.is_occupied(pt)
+
+   def is_open_for_blob(self, pt):
+      return (not self.is_occupied(pt) or
+         isinstance(self.get_tile_occupant(pt), entities.Ore))
 
-            if (self.within_bounds(new_pt) and
-               (not self.is_occupied(new_pt))):
-               return new_pt
+   def path_next_position(self, entity_pt, dest_pt, type):
+      new_pt = None
+      if type in self.distance_fields:
+         new_pt = self.distance_fields[type].next_position(entity_pt,
+            self.is_open)
+      return new_pt or self.next_position(entity_pt, dest_pt)
+
+   def blob_path_next_position(self, entity_pt, dest_pt, type):
+      new_pt = None
+      if type in self.distance_fields:
+         new_pt = self.distance_fields[type].next_position(entity_pt,
+            self.is_open_for_blob)
+      return new_pt or self.blob_next_position(entity_pt, dest_pt)
+
+   def find_open_around(self, pt, distance):
+      cell = self.occupancy.first_free_in_window(pt.x - distance,
+         pt.y - distance, 2 * distance + 1, 2 * distance + 1)
+      if cell:
+         return point.Point(cell[0], cell[1])
 
       return None
 
@@ -199,8 +378,8 @@ class WorldModel:
       return vein
 
    def clear_pending_actions(self, entity):
-      for action in entity.get_pending_actions():
-         self.unschedule_action(action)
+      for handle in entity.get_pending_actions():
+         self.unschedule_action(handle)
       entity.clear_pending_actions()
 
 
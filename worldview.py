@@ -1,3 +1,5 @@
+import collections
+import image_store
 import pygame
 import worldmodel
 import entities
@@ -7,6 +9,13 @@ MOUSE_HOVER_ALPHA = 120
 MOUSE_HOVER_EMPTY_COLOR = (0, 255, 0)
 MOUSE_HOVER_OCC_COLOR = (255, 0, 0)
 
+TILE_CACHE_SIZE = 512
+BACKGROUND_CHUNK_SIZE = 16
+BACKGROUND_CHUNK_LIMIT = 64
+
+ZOOM_TILE_SIZES = [4, 8, 16, 32]
+ZOOM_FILL_COLOR = (0, 0, 0)
+
 class WorldView:
    def __init__(self, view_cols, view_rows, screen, world, tile_width,
       tile_height, mouse_img=None):
@@ -16,9 +25,21 @@ class WorldView:
       self.world = world
       self.tile_width = tile_width
       self.tile_height = tile_height
+      self.native_width = tile_width
+      self.native_height = tile_height
       self.num_rows = world.num_rows
       self.num_cols = world.num_cols
       self.mouse_img = mouse_img
+      self.tile_cache = collections.OrderedDict()
+      self.background_chunks = collections.OrderedDict()
+      self.chunk_limit = BACKGROUND_CHUNK_LIMIT
+      self.scaled_images = image_store.ScaledImageCache()
+      self.animation_ticks = world.ticks
+      self.dirty = set()
+      self.redraw = False
+      self.suspended = False
+      self.overlays = []
+      world.subscribe(self.world_changed)
 
    def viewport_to_world(self, pt):
       return point.Point(pt.x + self.viewport.left, pt.y + self.viewport.top)
@@ -36,43 +57,268 @@ class WorldView:
    def clamp(self, v, low, high):
       return min(high, max(v, low))
 
-   def draw_background(self):
-      for y in range(0, self.viewport.height):
-         for x in range(0, self.viewport.width):
-            w_pt = self.viewport_to_world(point.Point(x, y))
-            img = self.world.get_background_image(w_pt)
-            self.screen.blit(img, (x * self.tile_width, y * self.tile_height))
+   def get_background_chunk(self, cx, cy):
+      chunk = self.background_chunks.get((cx, cy))
+      if chunk is not None:
+         self.background_chunks.move_to_end((cx, cy))
+      else:
+         size = BACKGROUND_CHUNK_SIZE
+         chunk = pygame.Surface((size * self.tile_width,
+            size * self.tile_height))
+         for y in range(cy * size, min((cy + 1) * size, self.num_rows)):
+            for x in range(cx * size, min((cx + 1) * size, self.num_cols)):
+               self.blit_background_tile(chunk, point.Point(x, y))
+         self.background_chunks[(cx, cy)] = chunk
+         if len(self.background_chunks) > self.chunk_limit:
+            self.background_chunks.popitem(last=False)
+      return chunk
+
+   def blit_background_tile(self, chunk, pt):
+      size = BACKGROUND_CHUNK_SIZE
+      chunk.blit(self.get_scaled(self.world.get_background_image(pt)),
+         ((pt.x % size) * self.tile_width, (pt.y % size) * self.tile_height))
+
+   def invalidate_background(self, pt):
+      size = BACKGROUND_CHUNK_SIZE
+      chunk = self.background_chunks.get((pt.x // size, pt.y // size))
+      if chunk is not None:
+         self.blit_background_tile(chunk, pt)
+
+   def reset_background(self):
+      self.background_chunks = collections.OrderedDict()
 
-   def draw_entities(self):
-      for entity in self.world.entities:
-         if self.viewport.collidepoint(entity.position.x, entity.position.y):
-            v_pt = self.world_to_viewport(entity.position)
-            self.screen.blit(entity.get_image(),
-               (v_pt.x * self.tile_width, v_pt.y * self.tile_height))
+   def draw_background(self, rect=None):
+      rect = rect or self.viewport
+      size = BACKGROUND_CHUNK_SIZE
+      for cy in range(rect.top // size, (rect.bottom - 1) // size + 1):
+         for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+            part = pygame.Rect(cx * size, cy * size, size, size).clip(rect)
+            area = pygame.Rect((part.left - cx * size) * self.tile_width,
+               (part.top - cy * size) * self.tile_height,
+               part.width * self.tile_width, part.height * self.tile_height)
+            self.screen.blit(self.get_background_chunk(cx, cy),
+               ((part.left - self.viewport.left) * self.tile_width,
+               (part.top - self.viewport.top) * self.tile_height), area)
+
+   def draw_entities(self, rect=None):
+      rect = rect or self.viewport
+      for y in range(rect.top, rect.bottom):
+         for x in range(rect.left, rect.right):
+            entity = self.world.get_tile_occupant(point.Point(x, y))
+            if entity:
+               self.screen.blit(self.get_scaled(
+                  self.world.get_entity_image(entity)),
+                  ((x - self.viewport.left) * self.tile_width,
+                  (y - self.viewport.top) * self.tile_height))
 
    def draw_viewport(self):
+      self.dirty = set()
+      self.redraw = False
       self.draw_background()
       self.draw_entities()
 
+   def scroll_viewport(self, new_viewport):
+      dx = new_viewport.left - self.viewport.left
+      dy = new_viewport.top - self.viewport.top
+      self.update_tile(self.mouse_pt, self.get_tile_image(self.mouse_pt))
+      self.viewport = new_viewport
+      self.screen.scroll(-dx * self.tile_width, -dy * self.tile_height)
+
+      strips = []
+      if dx > 0:
+         strips.append(pygame.Rect(new_viewport.right - dx, new_viewport.top,
+            dx, new_viewport.height))
+      elif dx < 0:
+         strips.append(pygame.Rect(new_viewport.left, new_viewport.top,
+            -dx, new_viewport.height))
+      if dy > 0:
+         strips.append(pygame.Rect(new_viewport.left, new_viewport.bottom - dy,
+            new_viewport.width, dy))
+      elif dy < 0:
+         strips.append(pygame.Rect(new_viewport.left, new_viewport.top,
+            new_viewport.width, -dy))
+      # Overlays were scrolled along with the tiles, so the tiles under
+      # where they moved to are redrawn before they go back on top.
+      for overlay in self.overlays:
+         covered = self.get_covered_tiles(overlay.rect.move(
+            -dx * self.tile_width, -dy * self.tile_height))
+         if covered:
+            strips.append(covered)
+
+      for strip in strips:
+         self.draw_background(strip)
+         self.draw_entities(strip)
+
+   def get_scaled(self, img):
+      # Images are loaded for the tile size the view was created with.
+      if (self.tile_width == self.native_width and
+         self.tile_height == self.native_height):
+         return img
+      return self.scaled_images.get(img,
+         img.get_width() * self.tile_width // self.native_width,
+         img.get_height() * self.tile_height // self.native_height)
+
+   def set_tile_size(self, size):
+      # Keeps the same world tile at the centre and redraws everything at
+      # the new size; the viewport grows or shrinks to fill the screen.
+      (center_x, center_y) = self.viewport.center
+      (screen_width, screen_height) = self.screen.get_size()
+      width = min(screen_width // size, self.num_cols)
+      height = min(screen_height // size, self.num_rows)
+      self.viewport = pygame.Rect(
+         self.clamp(center_x - width // 2, 0, self.num_cols - width),
+         self.clamp(center_y - height // 2, 0, self.num_rows - height),
+         width, height)
+      self.tile_width = size
+      self.tile_height = size
+      self.mouse_pt = point.Point(min(self.mouse_pt.x, width - 1),
+         min(self.mouse_pt.y, height - 1))
+      chunk_size = BACKGROUND_CHUNK_SIZE
+      self.chunk_limit = max(BACKGROUND_CHUNK_LIMIT,
+         2 * (width // chunk_size + 2) * (height // chunk_size + 2))
+      self.tile_cache = collections.OrderedDict()
+      self.reset_background()
+
+      self.screen.fill(ZOOM_FILL_COLOR)
+      self.draw_viewport()
+      self.update_display()
+      self.mouse_move(self.mouse_pt)
+
+   def zoom(self, steps):
+      sizes = ZOOM_TILE_SIZES
+      index = min(range(len(sizes)),
+         key=lambda i: abs(sizes[i] - self.tile_width))
+      index = self.clamp(index + steps, 0, len(sizes) - 1)
+      if sizes[index] != self.tile_width:
+         self.set_tile_size(sizes[index])
+
+   def center_on(self, pt):
+      self.update_view((pt.x - self.viewport.width // 2 - self.viewport.left,
+         pt.y - self.viewport.height // 2 - self.viewport.top),
+         self.mouse_img)
+
+   def add_overlay(self, overlay):
+      self.overlays.append(overlay)
+
+   def overlay_at(self, pos):
+      for overlay in self.overlays:
+         if overlay.rect.collidepoint(pos):
+            return overlay
+      return None
+
+   def update_display(self, rects=None):
+      # Overlays are drawn over the tiles last, and only when they changed
+      # or something was drawn underneath them.
+      for overlay in self.overlays:
+         rect = overlay.draw(self.screen, rects)
+         if rect is not None and rects is not None:
+            rects.append(rect)
+      if rects is None:
+         pygame.display.update()
+      elif rects:
+         pygame.display.update(rects)
+
+   def get_covered_tiles(self, rect):
+      left = rect.left // self.tile_width
+      top = rect.top // self.tile_height
+      return pygame.Rect(left + self.viewport.left, top + self.viewport.top,
+         (rect.right - 1) // self.tile_width - left + 1,
+         (rect.bottom - 1) // self.tile_height - top + 1).clip(self.viewport)
+
    def update_view(self, view_delta=(0,0), mouse_img=None):
-      self.viewport = self.create_shifted_viewport(view_delta, self.num_rows,
+      new_viewport = self.create_shifted_viewport(view_delta, self.num_rows,
          self.num_cols)
       self.mouse_img = mouse_img
-      self.draw_viewport()
-      pygame.display.update()
+      if (new_viewport.topleft != self.viewport.topleft and
+         abs(new_viewport.left - self.viewport.left) < new_viewport.width and
+         abs(new_viewport.top - self.viewport.top) < new_viewport.height):
+         self.scroll_viewport(new_viewport)
+      else:
+         self.viewport = new_viewport
+         self.draw_viewport()
+      self.update_display()
       self.mouse_move(self.mouse_pt)  
 
-   def update_view_tiles(self, tiles):
+   def get_animated_tiles(self):
+      # Visible tiles whose animation frame changed since the last call.
+      # Everything on screen was drawn at or after the previous call, so
+      # comparing the two frames is enough.
+      tiles = []
+      before = self.animation_ticks
+      now = self.world.ticks
+      self.animation_ticks = now
+      if now == before:
+         return tiles
+      for y in range(self.viewport.top, self.viewport.bottom):
+         for x in range(self.viewport.left, self.viewport.right):
+            pt = point.Point(x, y)
+            entity = self.world.get_tile_occupant(pt)
+            if (isinstance(entity, entities.Animated) and
+               entity.get_image_at(now) is not entity.get_image_at(before)):
+               tiles.append(pt)
+      return tiles
+
+   def world_changed(self, event, pt, entity, old_pt):
+      if event == worldmodel.CHUNK_LOADED:
+         return
+      if event == worldmodel.BACKGROUND_CHANGED:
+         if pt is None:
+            self.reset_background()
+            self.redraw = True
+            return
+         self.invalidate_background(pt)
+      elif event == worldmodel.ENTITY_MOVED:
+         self.mark_dirty(old_pt)
+      self.mark_dirty(pt)
+
+   def suspend(self):
+      # Stops following world changes, as while the world is fast-forwarded.
+      # resume redraws the whole viewport once.
+      if not self.suspended:
+         self.suspended = True
+         self.world.unsubscribe(self.world_changed)
+
+   def resume(self):
+      if self.suspended:
+         self.suspended = False
+         self.world.subscribe(self.world_changed)
+         self.reset_background()
+         self.animation_ticks = self.world.ticks
+         self.draw_viewport()
+         self.update_display()
+         self.mouse_move(self.mouse_pt)
+
+   def mark_dirty(self, pt):
+      if self.viewport.collidepoint(pt.x, pt.y):
+         self.dirty.add((pt.x, pt.y))
+
+   def flush_dirty(self):
+      # Redraws each changed tile once, however many changes it saw since
+      # the last flush.  Tiles scrolled out of view in the meantime are
+      # skipped; the scroll already drew the ones that came into view.
+      dirty = self.dirty
+      self.dirty = set()
+      if self.redraw:
+         self.redraw = False
+         self.draw_viewport()
+         self.update_display()
+         self.mouse_move(self.mouse_pt)
+         return
+
       rects = []
-      for tile in tiles:
-         if self.viewport.collidepoint(tile.x, tile.y):
-            v_pt = self.world_to_viewport(tile)
-            img = self.get_tile_image(v_pt)
-            rects.append(self.update_tile(v_pt, img))
+      for (x, y) in dirty:
+         if self.viewport.collidepoint(x, y):
+            v_pt = point.Point(x - self.viewport.left, y - self.viewport.top)
+            rects.append(self.update_tile(v_pt, self.get_tile_image(v_pt)))
             if self.mouse_pt.x == v_pt.x and self.mouse_pt.y == v_pt.y:
-               rects.append(self.update_mouse_cursor())
+               self.update_mouse_cursor()
 
-      pygame.display.update(rects)
+      self.update_display(rects)
+
+   def update_view_tiles(self, tiles):
+      for tile in tiles:
+         self.mark_dirty(tile)
+      self.flush_dirty()
 
    def update_tile(self, view_tile_pt, surface):
       abs_x = view_tile_pt.x * self.tile_width
@@ -84,16 +330,28 @@ class WorldView:
 
    def get_tile_image(self, view_tile_pt):
       pt = self.viewport_to_world(view_tile_pt)
-      bgnd = self.world.get_background_image(pt)
+      bgnd = self.get_scaled(self.world.get_background_image(pt))
       occupant = self.world.get_tile_occupant(pt)
       if occupant:
-         img = pygame.Surface((self.tile_width, self.tile_height))
-         img.blit(bgnd, (0, 0))
-         img.blit(occupant.get_image(), (0,0))
-         return img
+         return self.get_composite_image(bgnd,
+            self.get_scaled(self.world.get_entity_image(occupant)))
       else:
          return bgnd
 
+   def get_composite_image(self, bgnd, occupant_img):
+      key = (bgnd, occupant_img)
+      img = self.tile_cache.get(key)
+      if img is not None:
+         self.tile_cache.move_to_end(key)
+      else:
+         img = pygame.Surface((self.tile_width, self.tile_height))
+         img.blit(bgnd, (0, 0))
+         img.blit(occupant_img, (0,0))
+         self.tile_cache[key] = img
+         if len(self.tile_cache) > TILE_CACHE_SIZE:
+            self.tile_cache.popitem(last=False)
+      return img
+
    def create_mouse_surface(self, occupied):
       surface = pygame.Surface((self.tile_width, self.tile_height))
       surface.set_alpha(MOUSE_HOVER_ALPHA)
@@ -102,7 +360,7 @@ class WorldView:
          color = MOUSE_HOVER_OCC_COLOR
       surface.fill(color)
       if self.mouse_img:
-         surface.blit(self.mouse_img, (0, 0))
+         surface.blit(self.get_scaled(self.mouse_img), (0, 0))
 
       return surface
 
@@ -122,5 +380,5 @@ class WorldView:
 
       rects.append(self.update_mouse_cursor())
 
-      pygame.display.update(rects)
+      self.update_display(rects)
 